@@ -0,0 +1,28 @@
+"""
+gunicorn settings, read from the working directory by the Procfile command.
+
+The master imports the app and loads its data once (preload_app and
+app.preload), then forks the workers, which share those pages copy-on-write.
+The garbage collector would write to every object it tracks when a worker
+collects, copying the shared pages, so it is disabled while the app loads,
+the loaded objects are frozen out of its reach before forking and it is
+enabled again in the master and each worker.
+"""
+
+import gc
+
+preload_app = True
+
+gc.disable()
+
+
+def when_ready(server):
+    import app
+
+    app.preload()
+    gc.freeze()
+    gc.enable()
+
+
+def post_fork(server, worker):
+    gc.enable()
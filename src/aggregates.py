@@ -0,0 +1,161 @@
+"""
+Population weighted temperature series of every country and of the world.
+
+The (countries x days) weighted sums are a grouped matrix product of a
+(countries x cities) population matrix with the (cities x days) temperature
+matrix, done in one pass over the store a block of cities at a time: the
+block's rows are sorted by country and summed with np.add.reduceat. Missing
+days are left out of the sums and of the weights, so each day is the mean
+of the cities with a value that day. The world series is the sum over the
+countries.
+
+The series are saved as aggregates.npz in the dataset store, with their own
+quality and climatology arrays, so the charts read a country exactly as
+they read a city. Series are named by key:
+
+    city_id_<index>      a city, a row of the store
+    country_id_<code>    a country, by its code in the city lookup
+    global               the world
+"""
+
+import collections
+
+import numpy as np
+import pandas as pd
+
+from climatology import compute_climatology, load_climatology
+from data_quality import compute_quality, load_quality
+from process_data import (
+    STORE_DECIMALS,
+    build_reduced_city_lookup,
+    city_by_index,
+    derived,
+    load_dataset,
+)
+
+CITY_KEY = "city_id_"
+COUNTRY_KEY = "country_id_"
+GLOBAL_KEY = "global"
+GLOBAL_NAME = "World"
+CITY_BLOCK = 256
+
+# row of the series in values, a (series x days) matrix, and the quality and
+# climatology arrays of that matrix
+SeriesSource = collections.namedtuple(
+    "SeriesSource", ["row", "values", "quality", "climatology"]
+)
+
+
+def compute_aggregates(
+    temperatures: np.ndarray, country_codes: np.ndarray, population: np.ndarray
+):
+    """(countries + 1 x days) weighted means, the last row is the world"""
+    n_countries = int(country_codes.max()) + 1
+    n_days = temperatures.shape[1]
+    sums = np.zeros((n_countries, n_days), dtype=np.float64)
+    weights = np.zeros((n_countries, n_days), dtype=np.float64)
+    # Cities without a population still count a little
+    city_weights = np.maximum(population.astype(np.float64), 1)
+
+    for block in range(0, len(temperatures), CITY_BLOCK):
+        codes = country_codes[block : block + CITY_BLOCK]
+        order = np.argsort(codes, kind="stable")
+        countries, starts = np.unique(codes[order], return_index=True)
+
+        values = np.asarray(temperatures[block : block + CITY_BLOCK])[order]
+        valid = ~np.isnan(values)
+        weight = city_weights[block : block + CITY_BLOCK][order, np.newaxis]
+        sums[countries] += np.add.reduceat(
+            np.where(valid, values, 0) * weight, starts, axis=0
+        )
+        weights[countries] += np.add.reduceat(valid * weight, starts, axis=0)
+
+    sums = np.vstack([sums, sums.sum(axis=0)])
+    weights = np.vstack([weights, weights.sum(axis=0)])
+    series = np.divide(
+        sums, weights, out=np.full(sums.shape, np.nan), where=weights > 0
+    )
+    return series.astype(np.float32)
+
+
+def _aggregate_arrays(_dates: np.ndarray, temperatures: np.ndarray):
+    city_lookup = build_reduced_city_lookup()
+    return {
+        "series": compute_aggregates(
+            temperatures,
+            city_lookup["country"].cat.codes.to_numpy(),
+            city_lookup["population"].to_numpy(),
+        ),
+        "countries": city_lookup["country"].cat.categories.to_numpy(str),
+    }
+
+
+def load_aggregates():
+    """
+    Aggregate series, their quality and climatology arrays of the current
+    dataset, computed on first use
+    """
+    aggregates = derived("aggregates", _aggregate_arrays)
+    series = aggregates["series"]
+    quality = derived(
+        "aggregates_quality",
+        lambda dates, _temperatures: compute_quality(dates, series),
+    )
+    climatology = derived(
+        "aggregates_climatology",
+        lambda dates, _temperatures: compute_climatology(dates, series),
+    )
+    return aggregates, quality, climatology
+
+
+def series_source(key: str):
+    """Where the charts read the series of a key"""
+    if key.startswith(CITY_KEY):
+        city_id = int(key[len(CITY_KEY) :])
+        _dates, temperatures, _meta = load_dataset()
+        return SeriesSource(city_id, temperatures, load_quality(), load_climatology())
+
+    aggregates, quality, climatology = load_aggregates()
+    if key == GLOBAL_KEY:
+        row = len(aggregates["countries"])
+    elif key.startswith(COUNTRY_KEY):
+        row = int(key[len(COUNTRY_KEY) :])
+        if not 0 <= row < len(aggregates["countries"]):
+            raise LookupError(key)
+    else:
+        raise LookupError(key)
+    return SeriesSource(row, aggregates["series"], quality, climatology)
+
+
+def series_by_key(key: str):
+    """Series of a city, country or the world, like city_by_index"""
+    if key.startswith(CITY_KEY):
+        return city_by_index(int(key[len(CITY_KEY) :]))
+
+    source = series_source(key)
+    dates, _temperatures, _meta = load_dataset()
+    return pd.Series(
+        source.values[source.row].astype(np.float64).round(STORE_DECIMALS),
+        index=pd.DatetimeIndex(dates, name="datetime"),
+        name=key,
+    )
+
+
+def series_name(key: str):
+    """Heading of the series of a key"""
+    if key == GLOBAL_KEY:
+        return GLOBAL_NAME
+    if key.startswith(COUNTRY_KEY):
+        return str(load_aggregates()[0]["countries"][int(key[len(COUNTRY_KEY) :])])
+    city_lookup = build_reduced_city_lookup()
+    city_id = int(key[len(CITY_KEY) :])
+    return f"{city_lookup['city'].iat[city_id]}, {city_lookup['country'].iat[city_id]}"
+
+
+def aggregate_options():
+    """Dropdown options of the world and every country"""
+    countries = load_aggregates()[0]["countries"]
+    return [{"label": GLOBAL_NAME, "value": GLOBAL_KEY}] + [
+        {"label": str(country), "value": f"{COUNTRY_KEY}{code}"}
+        for code, country in enumerate(countries)
+    ]
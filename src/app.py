@@ -1,12 +1,12 @@
 # Daily average temperature values recorded in major cities of the world
 
 import pandas as pd
-from matplotlib import cm
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 import plotly.express as px
 import dash
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, ALL
+from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
 import datetime
@@ -15,23 +15,53 @@ import functools
 import dash_leaflet as dl
 import numpy as np
 import dash_daq as daq
-from joblib import Memory
 import flask
+import json
 import os
 
 from datetime import datetime as dt
 from process_data import (
+    STORE_DECIMALS,
     city_by_index,
+    load_dataset,
     data_summary,
     city_by_name,
     build_reduced_city_lookup,
 )
 from process_city_data import (
     calc_monthly,
+    day_of_year_slots,
+    year_doy_matrix,
+)
+from palette import year_colors
+from figure_store import FIGURE_DIR, FigureStore
+from profiling import is_profiling, register_profiler
+from data_quality import (
+    complete_years,
+    gap_years,
+    load_quality,
+    missing_days,
+    outlier_mask,
+)
+from climatology import load_climatology
+from aggregates import aggregate_options, series_by_key, series_name, series_source
+from city_api import register_city_api
+from export_api import load_yearly, register_export_api
+from monthly_stats import load_monthly, register_monthly_api
+from city_clusters import (
+    build_cluster_hierarchy,
+    cluster_level,
+    clusters_in_bounds,
+    expansion_zoom,
+    register_cluster_api,
+    view_bounds,
 )
 
 DEBUG = False
-memory = Memory(None) if DEBUG else Memory("cache", verbose=0)
+# A profiled request builds its figures, a store hit would only time a JSON read
+memory = FigureStore(
+    None if DEBUG else FIGURE_DIR, load_dataset()[2]["version"], bypass=is_profiling
+)
 
 city_lookup = build_reduced_city_lookup()
 starting_city_id = 8  # Los Angeles, United States
@@ -92,29 +122,29 @@ app = dash.Dash(
 </html>""",
 )
 server = app.server
+register_profiler(server)
+register_city_api(server)
+register_export_api(server)
+register_monthly_api(server)
 
-starting_position = (
-    float(city_lookup.iloc[[starting_city_id]]["lat"]),
-    float(city_lookup.iloc[[starting_city_id]]["lng"]),
-)
+
+def city_position(city_id):
+    """float32 coordinates rounded back to the 4 decimals of the source data"""
+    return (
+        round(float(city_lookup["lat"].iat[city_id]), 4),
+        round(float(city_lookup["lng"].iat[city_id]), 4),
+    )
+
+
+starting_position = city_position(starting_city_id)
 
 print("starting_position", starting_position)
 
 
-markers = [
-    dl.Marker(
-        dl.Tooltip(city_row.city + ", " + city_row.country),
-        position=(
-            float(city_row["lat"]),
-            float(city_row["lng"]),
-        ),
-        id="city_id_" + str(i),
-    )
-    for i, city_row in city_lookup.iterrows()
-]
-cluster = dl.MarkerClusterGroup(
-    id="markers", children=markers, options={"polygonOptions": {"color": "red"}}
-)
+# Markers are clustered on the server and only the clusters in view are sent
+cluster_hierarchy = build_cluster_hierarchy(city_lookup)
+register_cluster_api(server, cluster_hierarchy, city_lookup)
+city_layer = dl.LayerGroup(id="city-layer")
 
 
 app.layout = html.Div(
@@ -127,7 +157,7 @@ app.layout = html.Div(
             [
                 html.Div(
                     dl.Map(
-                        [dl.TileLayer(), cluster],
+                        [dl.TileLayer(), city_layer],
                         center=starting_position,
                         zoom=5,
                         id="map",
@@ -150,13 +180,28 @@ app.layout = html.Div(
                     id="intermediate-value", children="", style={"display": "none"}
                 ),
                 html.P(children=title),
+                dcc.Dropdown(
+                    id="aggregate-dropdown",
+                    options=aggregate_options(),
+                    placeholder="Or pick a country, weighted by city population",
+                ),
                 daq.ToggleSwitch(
                     id="my-daq-toggleswitch",
                     label="Celsius °C   - Fahrenheit °F",
                     labelPosition="bottom",
                 ),
                 dcc.Graph(id="all-graph"),
+                dcc.Graph(id="climatology-graph"),
                 dcc.Graph(id="yearly-average-graph"),
+                dcc.RadioItems(
+                    id="yearly-graph-mode",
+                    options=[
+                        {"label": "Lines", "value": "lines"},
+                        {"label": "Heatmap", "value": "heatmap"},
+                    ],
+                    value="lines",
+                    labelStyle={"display": "inline-block", "padding": "0 0.5rem"},
+                ),
                 dcc.Graph(id="yearly-graph"),
             ],
         ),
@@ -191,19 +236,68 @@ def serve_static(resource):
     return flask.send_from_directory(STATIC_PATH, resource)
 
 
+def city_layer_marker(level_zoom, i):
+    """Marker for a single city or circle sized by the number of cities in a cluster"""
+    level = cluster_hierarchy[level_zoom]
+    position = (round(float(level["lat"][i]), 4), round(float(level["lng"][i]), 4))
+    count = int(level["count"][i])
+    if count == 1:
+        city_id = int(level["city_id"][i])
+        return dl.Marker(
+            dl.Tooltip(
+                city_lookup["city"].iat[city_id]
+                + ", "
+                + city_lookup["country"].iat[city_id]
+            ),
+            position=position,
+            id={"type": "city-marker", "index": city_id},
+        )
+
+    return dl.CircleMarker(
+        dl.Tooltip(f"{count} cities"),
+        center=position,
+        radius=int(8 + 3 * np.log2(count)),
+        color="red",
+        fillOpacity=0.5,
+        id={"type": "city-cluster", "index": f"{level_zoom}_{i}"},
+    )
+
+
+@app.callback(
+    Output("city-layer", "children"),
+    [Input("map", "zoom"), Input("map", "bounds")],
+)
+def update_city_layer(zoom, bounds):
+    # The map reports its bounds after the first render, until then send the
+    # clusters around the starting city rather than the whole world
+    if bounds is None:
+        bounds = view_bounds(starting_position, zoom)
+    level_zoom = cluster_level(cluster_hierarchy, zoom)
+    return [
+        city_layer_marker(level_zoom, i)
+        for i in clusters_in_bounds(cluster_hierarchy, level_zoom, bounds)
+    ]
+
+
+def triggered_marker():
+    """Id of the city or cluster marker that was clicked, None for other triggers"""
+    triggered = dash.callback_context.triggered[0]
+    if not triggered["value"] or not triggered["prop_id"].startswith("{"):
+        return None
+    return json.loads(triggered["prop_id"].rsplit(".", 1)[0])
+
+
 @app.callback(
     Output("url", "pathname"),
-    [Input(marker.id, "n_clicks") for marker in markers],
+    [Input({"type": "city-marker", "index": ALL}, "n_clicks")],
 )
 def marker_click(*args):
-    city_id_str = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
-    print("marker_click", city_id_str)
-    if len(city_id_str) > 0:
-        city_id = int(city_id_str.split("_")[-1])
-
-        city_row = city_lookup.iloc[[city_id]]
+    marker_id = triggered_marker()
+    print("marker_click", marker_id)
+    if marker_id is None:
+        raise PreventUpdate
 
-        return city_row.city
+    return city_lookup["city"].iat[marker_id["index"]]
 
 
 @app.callback(
@@ -211,13 +305,26 @@ def marker_click(*args):
         Output("city-name", "children"),
         Output("intermediate-value", "children"),
         Output("map", "center"),
+        Output("map", "zoom"),
+    ],
+    [
+        Input("url", "pathname"),
+        Input({"type": "city-marker", "index": ALL}, "n_clicks"),
+        Input({"type": "city-cluster", "index": ALL}, "n_clicks"),
+        Input("aggregate-dropdown", "value"),
     ],
-    [dash.dependencies.Input("url", "pathname")]
-    + [Input(marker.id, "n_clicks") for marker in markers],
 )
 def marker_click(*args):
     city_id = None
-    if dash.callback_context.triggered[0]["prop_id"] == "url.pathname":
+    marker_id = triggered_marker()
+    prop_id = dash.callback_context.triggered[0]["prop_id"]
+    if prop_id == "aggregate-dropdown.value":
+        # A country or the world, the map stays where it is
+        key = args[3]
+        if not key:
+            raise PreventUpdate
+        return series_name(key), key, dash.no_update, dash.no_update
+    elif prop_id == "url.pathname":
         pathname = args[0]
         city_name = urllib.parse.unquote(pathname[1:])
         print("pathname", pathname, city_name)
@@ -229,35 +336,34 @@ def marker_click(*args):
                 city_id = starting_city_id
             else:
                 city_id = int(city_col.index[0])
+    elif marker_id is None:
+        raise PreventUpdate
+    elif marker_id["type"] == "city-cluster":
+        level_zoom, i = [int(v) for v in marker_id["index"].split("_")]
+        level = cluster_hierarchy[level_zoom]
+        return (
+            dash.no_update,
+            dash.no_update,
+            (round(float(level["lat"][i]), 4), round(float(level["lng"][i]), 4)),
+            expansion_zoom(cluster_hierarchy, level_zoom),
+        )
     else:
-        city_id_str = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
-        city_id = int(city_id_str.split("_")[-1])
+        city_id = marker_id["index"]
 
-    city_row = city_lookup.iloc[[city_id]]
     selected_city_data = (
-        city_row.city + ", " + city_row.country,
+        city_lookup["city"].iat[city_id] + ", " + city_lookup["country"].iat[city_id],
         "city_id_" + str(city_id),
-        (
-            float(city_row["lat"]),
-            float(city_row["lng"]),
-        ),
+        city_position(city_id),
+        dash.no_update,
     )
     print(selected_city_data)
 
     return selected_city_data
 
 
-number_colors = 2021 - int(sample_city.index.min().year)
-viridis = cm.get_cmap("magma", None)
-
-year_colors = list(viridis(np.linspace(0.25, 0.6, number_colors)))
-year_colors_dict = {
-    i
-    + int(
-        sample_city.index.min().year
-    ): f"rgb({int(c[0] * 256)},{int(c[1] * 256)},{int(c[2] * 256)})"
-    for i, c in enumerate(year_colors)
-}
+year_colors_dict = year_colors(
+    int(sample_city.index.min().year), int(sample_city.index.max().year)
+)
 
 
 def get_symbol(is_fahrenheit):
@@ -277,8 +383,8 @@ def _build_city_all_with_mean(city_country, is_fahrenheit):
 
 @memory.cache
 def build_city_all_with_mean(city_country, is_fahrenheit):
-    city_id = int(city_country.split("_")[-1])
-    city_df = city_by_index(city_id)
+    source = series_source(city_country)
+    city_df = series_by_key(city_country)
 
     if is_fahrenheit:
         city_df = (city_df / (5 / 9)) + (32)
@@ -300,12 +406,10 @@ def build_city_all_with_mean(city_country, is_fahrenheit):
             )
         )
 
-    yearly_mean = (
-        city_df[city_df.index.year < city_df.index.max().year]
-        .astype(float)
-        .resample("Y")
-        .mean()
-    )
+    yearly_mean = city_df.resample("Y").mean()
+    yearly_mean = yearly_mean[
+        yearly_mean.index.year.isin(complete_years(source.row, quality=source.quality))
+    ]
 
     yearly_mean.index = yearly_mean.index.map(lambda dt: dt.replace(day=15, month=6))
 
@@ -318,6 +422,18 @@ def build_city_all_with_mean(city_country, is_fahrenheit):
         )
     )
 
+    outliers = city_df[outlier_mask(source.row, quality=source.quality)]
+    fig.add_trace(
+        go.Scatter(
+            x=outliers.index,
+            y=outliers,
+            name="Flagged outliers",
+            mode="markers",
+            marker={"color": "rgb(255, 255, 255)", "symbol": "x", "size": 6},
+            visible="legendonly",
+        )
+    )
+
     fig.update_layout(
         legend={"traceorder": "reversed"},
         template="plotly_dark",
@@ -328,6 +444,105 @@ def build_city_all_with_mean(city_country, is_fahrenheit):
     return fig
 
 
+@app.callback(
+    Output("climatology-graph", "figure"),
+    [
+        Input("intermediate-value", "children"),
+        Input("my-daq-toggleswitch", "value"),
+    ],
+)
+def _build_climatology_fig(city_country, is_fahrenheit):
+    return build_climatology_fig(city_country, is_fahrenheit)
+
+
+@memory.cache
+def build_climatology_fig(city_country, is_fahrenheit):
+    source = series_source(city_country)
+    city_df = series_by_key(city_country)
+    city_df = city_df[city_df.index.year == city_df.index.max().year]
+
+    climatology = source.climatology
+    band = {
+        name: climatology[name][source.row].astype(float).round(STORE_DECIMALS)
+        for name in ("mean", "p10", "p90", "record_high", "record_low")
+    }
+    if is_fahrenheit:
+        city_df = (city_df / (5 / 9)) + (32)
+        band = {name: (values / (5 / 9)) + (32) for name, values in band.items()}
+
+    # Slots line up with the days of a leap year
+    slot_dates = pd.date_range("2020-01-01", "2020-12-31")
+    _year, slots = day_of_year_slots(city_df.index.values.astype("datetime64[D]"))
+    year = city_df.index.max().year
+    city_df.index = slot_dates[slots]
+
+    baseline = f"{climatology['baseline'][0]}-{climatology['baseline'][1]}"
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scatter(
+            x=slot_dates,
+            y=band["p90"],
+            name=f"90th percentile {baseline}",
+            line={"color": "rgba(255, 127, 14, 0.3)", "width": 0},
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=slot_dates,
+            y=band["p10"],
+            name=f"10th percentile {baseline}",
+            fill="tonexty",
+            fillcolor="rgba(255, 127, 14, 0.2)",
+            line={"color": "rgba(255, 127, 14, 0.3)", "width": 0},
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=slot_dates,
+            y=band["mean"],
+            name=f"Average {baseline}",
+            line={"color": "rgb(255, 127, 14)", "width": 1, "dash": "dash"},
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=city_df.index,
+            y=city_df,
+            name=str(year),
+            mode="lines",
+            line={"color": "rgb(255, 255, 255)", "width": 2},
+        )
+    )
+
+    # Days of the year that set the record for their day of year
+    for name, label, color in (
+        ("record_high", "Record high", "rgb(255, 0, 0)"),
+        ("record_low", "Record low", "rgb(0, 170, 255)"),
+    ):
+        records = city_df[city_df.values == band[name][slots]]
+        fig.add_trace(
+            go.Scatter(
+                x=records.index,
+                y=records,
+                name=label,
+                mode="markers",
+                marker={"color": color, "size": 9, "symbol": "star"},
+            )
+        )
+
+    fig.update_layout(
+        legend={"traceorder": "reversed"},
+        template="plotly_dark",
+        xaxis=dict(
+            tickformat="%b",
+        ),
+        title=f"⛅ How unusual was {year}",
+        xaxis_title="Month",
+        yaxis_title=f"Daily air temperature 🌡 {get_symbol(is_fahrenheit)}",
+    )
+    return fig
+
+
 @app.callback(
     Output("yearly-average-graph", "figure"),
     [
@@ -342,8 +557,8 @@ def _get_yearly_avg_fig(city_country, is_fahrenheit):
 
 @memory.cache
 def get_yearly_avg_fig(city_country, is_fahrenheit):
-    city_id = int(city_country.split("_")[-1])
-    city_df = city_by_index(city_id)
+    source = series_source(city_country)
+    city_df = series_by_key(city_country)
     if is_fahrenheit:
         city_df = (city_df / (5 / 9)) + (32)
 
@@ -352,6 +567,7 @@ def get_yearly_avg_fig(city_country, is_fahrenheit):
     fig = go.Figure()
 
     yearly_data = city_df.groupby([city_df.index.year])
+    years_complete = set(complete_years(source.row, quality=source.quality))
 
     yearly_mean = city_df.resample("Y").mean()
     for y in yearly_data:
@@ -365,9 +581,7 @@ def get_yearly_avg_fig(city_country, is_fahrenheit):
             lambda dt: dt.replace(day=15, month=6)
         )
 
-        num_points = len(city_df[city_df.index.year == int(y[0])].dropna())
-
-        if num_points > 350:
+        if y[0] in years_complete:
             fig.add_trace(
                 go.Scatter(
                     x=single_year.index,
@@ -378,6 +592,18 @@ def get_yearly_avg_fig(city_country, is_fahrenheit):
                 )
             )
 
+    years, missing = missing_days(source.row, quality=source.quality)
+    fig.add_trace(
+        go.Bar(
+            x=[dt(year, 6, 15) for year in years],
+            y=missing,
+            name="Missing days",
+            yaxis="y2",
+            marker={"color": "rgba(255, 255, 255, 0.3)"},
+            visible="legendonly",
+        )
+    )
+
     fig.update_layout(
         legend={"traceorder": "reversed"},
         template="plotly_dark",
@@ -385,6 +611,12 @@ def get_yearly_avg_fig(city_country, is_fahrenheit):
         xaxis=dict(
             tickformat="%Y",
         ),
+        yaxis2=dict(
+            title="Missing days",
+            overlaying="y",
+            side="right",
+            showgrid=False,
+        ),
         xaxis_title="Year",
         yaxis_title=f"Yearly average air temperature 🌡 {get_symbol(is_fahrenheit)}",
     )
@@ -396,20 +628,24 @@ def get_yearly_avg_fig(city_country, is_fahrenheit):
     [
         Input("intermediate-value", "children"),
         Input("my-daq-toggleswitch", "value"),
+        Input("yearly-graph-mode", "value"),
     ],
 )
-def _update_month_each_year_graph(city_country, is_fahrenheit):
+def _update_month_each_year_graph(city_country, is_fahrenheit, mode):
+    if mode == "heatmap":
+        return build_year_heatmap_fig(city_country, is_fahrenheit)
     return update_month_each_year_graph(city_country, is_fahrenheit)
 
 
 @memory.cache
 def update_month_each_year_graph(city_country, is_fahrenheit):
-    city_id = int(city_country.split("_")[-1])
-    city_df = city_by_index(city_id)
+    source = series_source(city_country)
+    city_df = series_by_key(city_country)
     if is_fahrenheit:
         city_df = (city_df / (5 / 9)) + (32)
 
     yearly_data = city_df.groupby([city_df.index.year])
+    years_with_gaps = set(gap_years(source.row, quality=source.quality))
 
     fig = go.Figure()
 
@@ -421,14 +657,21 @@ def update_month_each_year_graph(city_country, is_fahrenheit):
 
         series = series.groupby(pd.Grouper(freq="15D")).mean()
 
+        # Years with long runs of missing days are dotted
+        has_gaps = y[0] in years_with_gaps
+
         fig.add_trace(
             go.Scatter(
                 x=series.index,
                 y=series,
-                name=y[0],
+                name=f"{y[0]} (gaps)" if has_gaps else y[0],
                 opacity=0.8,
                 mode="markers+lines",
-                line={"color": chosen_color, "width": 2},
+                line={
+                    "color": chosen_color,
+                    "width": 2,
+                    "dash": "dot" if has_gaps else "solid",
+                },
                 marker={"color": chosen_color, "size": 6},
             )
         )
@@ -446,5 +689,68 @@ def update_month_each_year_graph(city_country, is_fahrenheit):
     return fig
 
 
+@memory.cache
+def build_year_heatmap_fig(city_country, is_fahrenheit):
+    """One heatmap trace of the city's (years x 366 days) temperatures"""
+    source = series_source(city_country)
+    dates, _temperatures, _meta = load_dataset()
+
+    # float32 straight from the store, 41 years are ~60KB
+    years, matrix = year_doy_matrix(dates, source.values[source.row])
+    if is_fahrenheit:
+        matrix = (matrix / np.float32(5 / 9)) + np.float32(32)
+
+    fig = go.Figure(
+        go.Heatmap(
+            x=pd.date_range("2020-01-01", "2020-12-31"),
+            y=years,
+            z=matrix.astype(float).round(1),
+            colorscale="RdBu",
+            reversescale=True,
+            colorbar={"title": get_symbol(is_fahrenheit)},
+            hovertemplate="%{x|%d %b} %{y}: %{z}<extra></extra>",
+        )
+    )
+
+    fig.update_layout(
+        template="plotly_dark",
+        xaxis=dict(
+            tickformat="%b",
+        ),
+        title=f"⛅ Every day from {years[0]} to {years[-1]}",
+        xaxis_title="Month",
+        yaxis_title="Year",
+    )
+    return fig
+
+
+def preload():
+    """
+    Load the derived arrays and run every chart and page request once. Under
+    gunicorn --preload the master calls this before forking, so the workers
+    share the arrays and the modules plotly and Dash import lazily instead of
+    loading a copy each on their first requests. See gunicorn.conf.py.
+    """
+    load_quality()
+    load_climatology()
+    load_monthly()
+    load_yearly()
+
+    client = server.test_client()
+    for path in ("/", "/_dash-layout", "/_dash-dependencies"):
+        client.get(path)
+
+    # .func builds the figures without writing them to the figure store
+    key = f"city_id_{starting_city_id}"
+    for chart in (
+        build_city_all_with_mean,
+        build_climatology_fig,
+        get_yearly_avg_fig,
+        update_month_each_year_graph,
+        build_year_heatmap_fig,
+    ):
+        chart.func(key, False)
+
+
 if __name__ == "__main__":
     app.run_server(debug=DEBUG)
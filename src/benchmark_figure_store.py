@@ -0,0 +1,65 @@
+"""
+Hit latency of the figure store against the joblib.Memory cache it replaced.
+
+    python benchmark_figure_store.py [--city 8] [--repeat 50]
+
+Builds every chart of a city once into a joblib cache and a figure store in
+a temporary directory, then times reading them back. A joblib hit unpickles
+a go.Figure, which validates every trace again, a figure store hit only
+parses its JSON.
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from joblib import Memory
+
+import app
+from figure_store import FigureStore
+from process_data import load_dataset
+
+CHARTS = (
+    app.build_city_all_with_mean,
+    app.build_climatology_fig,
+    app.get_yearly_avg_fig,
+    app.update_month_each_year_graph,
+    app.build_year_heatmap_fig,
+)
+
+
+def hit_latency(cached, args, repeat: int):
+    """Median and 99th percentile of the hit latency in ms"""
+    cached(*args)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cached(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.median(timings), np.percentile(timings, 99)
+
+
+def main(city_id: int, repeat: int):
+    version = load_dataset()[2]["version"]
+    args = (f"city_id_{city_id}", False)
+    with tempfile.TemporaryDirectory() as path:
+        memory = Memory(f"{path}/joblib", verbose=0)
+        store = FigureStore(f"{path}/figures", version)
+
+        print(f"{'chart':<30} {'joblib p50/p99':>16} {'store p50/p99':>16}")
+        for chart in CHARTS:
+            joblib_ms = hit_latency(memory.cache(chart.func), args, repeat)
+            store_ms = hit_latency(store.cache(chart.func), args, repeat)
+            print(
+                f"{chart.__name__:<30} {joblib_ms[0]:7.2f}/{joblib_ms[1]:<7.2f}ms"
+                f" {store_ms[0]:7.2f}/{store_ms[1]:<7.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--city", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    main(args.city, args.repeat)
@@ -0,0 +1,127 @@
+"""
+HTTP api serving windows of the city temperature series.
+
+    GET /api/city/<ids>?start=2000-01-01&end=2010-12-31&agg=monthly&format=json
+
+ids is one city index or a comma separated list. start and end are inclusive
+dates, default the whole record. agg is daily, monthly or yearly, unit c or f,
+format json, csv or arrow (Arrow IPC stream). Only the requested rows and date
+window are read from the store.
+"""
+
+import io
+import json
+
+import flask
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from process_city_data import period_means, period_starts
+from process_data import STORE_DECIMALS, build_reduced_city_lookup, cities_by_index
+
+AGGREGATIONS = ("daily", "monthly", "yearly")
+FORMATS = ("json", "csv", "arrow")
+MAX_CITIES = 100
+
+
+def city_window(city_ids, start=None, end=None, agg="daily", is_fahrenheit=False):
+    """Period labels and (cities x periods) temperatures of the requested window"""
+    dates, values = cities_by_index(city_ids, start, end)
+    if agg != "daily":
+        labels, starts = period_starts(dates, agg)
+        values = period_means(values, starts).round(STORE_DECIMALS)
+        dates = labels
+    if is_fahrenheit:
+        values = (values / (5 / 9) + 32).round(STORE_DECIMALS)
+    return dates, values
+
+
+def window_json(city_lookup, city_ids, dates, values):
+    return json.dumps(
+        {
+            "dates": np.datetime_as_string(dates).tolist(),
+            "cities": [
+                {
+                    "id": city_id,
+                    "city": city_lookup["city"].iat[city_id],
+                    "country": city_lookup["country"].iat[city_id],
+                    "values": [None if np.isnan(v) else v for v in row.tolist()],
+                }
+                for city_id, row in zip(city_ids, values)
+            ],
+        },
+        separators=(",", ":"),
+    )
+
+
+def window_csv(city_ids, dates, values):
+    frame = pd.DataFrame(
+        values.T,
+        index=pd.Index(np.datetime_as_string(dates), name="date"),
+        columns=[str(c) for c in city_ids],
+    )
+    return frame.to_csv()
+
+
+def window_arrow(city_ids, dates, values):
+    table = pa.table(
+        [pa.array(dates.astype("datetime64[D]"), type=pa.date32())]
+        + [pa.array(row.astype(np.float32), from_pandas=True) for row in values],
+        names=["date"] + [str(c) for c in city_ids],
+    )
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def parse_city_ids(ids: str, n_cities: int, max_cities: int = MAX_CITIES):
+    """Comma separated city indexes, "all" for every city"""
+    if ids == "all":
+        city_ids = list(range(n_cities))
+    else:
+        city_ids = [int(i) for i in ids.split(",")]
+    if len(city_ids) > max_cities:
+        raise ValueError(f"At most {max_cities} cities per request")
+    if any(i < 0 or i >= n_cities for i in city_ids):
+        raise LookupError(ids)
+    return city_ids
+
+
+def register_city_api(server: flask.Flask):
+    @server.route("/api/city/<ids>")
+    def _city(ids):
+        city_lookup = build_reduced_city_lookup()
+        args = flask.request.args
+        agg = args.get("agg", "daily")
+        output_format = args.get("format", "json")
+        try:
+            city_ids = parse_city_ids(ids, len(city_lookup))
+            if agg not in AGGREGATIONS or output_format not in FORMATS:
+                raise ValueError(agg, output_format)
+            dates, values = city_window(
+                city_ids,
+                args.get("start") or None,
+                args.get("end") or None,
+                agg,
+                args.get("unit", "c").lower() == "f",
+            )
+        except LookupError:
+            flask.abort(404)
+        except ValueError:
+            flask.abort(400)
+
+        if output_format == "csv":
+            return flask.Response(
+                window_csv(city_ids, dates, values), mimetype="text/csv"
+            )
+        if output_format == "arrow":
+            return flask.Response(
+                window_arrow(city_ids, dates, values),
+                mimetype="application/vnd.apache.arrow.stream",
+            )
+        return flask.Response(
+            window_json(city_lookup, city_ids, dates, values),
+            mimetype="application/json",
+        )
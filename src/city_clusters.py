@@ -0,0 +1,181 @@
+"""
+Server-side clustering of the city markers.
+
+A grid pyramid is precomputed over the web mercator projection of the city
+coordinates: at zoom z the world is split into CELLS_PER_TILE * 2**z cells a
+side and the cities in a cell form one cluster. Cells at z + 1 subdivide the
+cells at z so the levels nest into a hierarchy. Above MAX_CLUSTER_ZOOM every
+city is its own point. A request only filters the precomputed level for the
+current zoom by the visible bounds, so the browser receives a few dozen
+points whatever the number of cities.
+"""
+
+import json
+
+import flask
+import numpy as np
+import pandas as pd
+
+# 256px tiles split into 64px cells, roughly the leaflet.markercluster radius
+CELLS_PER_TILE = 4
+MAX_CLUSTER_ZOOM = 10
+MAX_MERCATOR_LAT = 85.0511
+# Pixel size assumed for the map before the browser reports its bounds, on
+# the large side so the first render does not miss clusters at the edges
+VIEW_WIDTH = 2048
+VIEW_HEIGHT = 1024
+
+
+def _mercator(lat: np.ndarray, lng: np.ndarray):
+    """Project to web mercator, normalised to [0, 1)"""
+    lat_rad = np.radians(
+        np.clip(lat.astype(np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    )
+    x = (lng.astype(np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0
+    return x, y
+
+
+def _cluster_level(x, y, lat, lng, population, zoom: int):
+    """Group the cities into the grid cells of one zoom level"""
+    n = CELLS_PER_TILE << zoom
+    cell_x = np.minimum((x * n).astype(np.int64), n - 1)
+    cell_y = np.clip((y * n).astype(np.int64), 0, n - 1)
+    _keys, inverse, counts = np.unique(
+        cell_x * n + cell_y, return_inverse=True, return_counts=True
+    )
+
+    # Most populous city of each cell names the cluster
+    order = np.lexsort((-population.astype(np.int64), inverse))
+    _groups, first = np.unique(inverse[order], return_index=True)
+
+    return {
+        "lat": (np.bincount(inverse, weights=lat) / counts).astype(np.float32),
+        "lng": (np.bincount(inverse, weights=lng) / counts).astype(np.float32),
+        "count": counts.astype(np.uint32),
+        "city_id": order[first].astype(np.int32),
+    }
+
+
+def build_cluster_hierarchy(city_lookup: pd.DataFrame):
+    """Precompute the clusters of every zoom level from the city lookup"""
+    lat = city_lookup["lat"].to_numpy()
+    lng = city_lookup["lng"].to_numpy()
+    population = city_lookup["population"].to_numpy()
+    x, y = _mercator(lat, lng)
+
+    hierarchy = {
+        zoom: _cluster_level(x, y, lat, lng, population, zoom)
+        for zoom in range(MAX_CLUSTER_ZOOM + 1)
+    }
+    hierarchy[MAX_CLUSTER_ZOOM + 1] = {
+        "lat": lat.astype(np.float32),
+        "lng": lng.astype(np.float32),
+        "count": np.ones(len(lat), dtype=np.uint32),
+        "city_id": np.arange(len(lat), dtype=np.int32),
+    }
+    return hierarchy
+
+
+def cluster_level(hierarchy, zoom):
+    """Clamp a (possibly fractional) map zoom to a precomputed level"""
+    return min(max(int(zoom or 0), 0), MAX_CLUSTER_ZOOM + 1)
+
+
+def clusters_in_bounds(hierarchy, zoom, bounds=None):
+    """
+    Index of the clusters of the zoom level inside leaflet style bounds
+    [[south, west], [north, east]]. Longitudes may run past +-180 when the map
+    is panned across the antimeridian.
+    """
+    level = hierarchy[cluster_level(hierarchy, zoom)]
+    if bounds is None:
+        return np.arange(len(level["count"]))
+
+    (south, west), (north, east) = bounds
+    lat, lng = level["lat"], level["lng"]
+    inside = (lat >= south) & (lat <= north)
+    if east - west < 360:
+        west = (west + 180) % 360 - 180
+        east = (east + 180) % 360 - 180
+        if west <= east:
+            inside &= (lng >= west) & (lng <= east)
+        else:
+            inside &= (lng >= west) | (lng <= east)
+    return np.flatnonzero(inside)
+
+
+def view_bounds(center, zoom, width=VIEW_WIDTH, height=VIEW_HEIGHT):
+    """
+    Leaflet style bounds of a map of width x height pixels centred on
+    (lat, lng) at the zoom, used until the browser sends the real bounds
+    """
+    lat, lng = center
+    world = 256.0 * 2 ** (zoom or 0)
+    x, y = _mercator(np.array([lat]), np.array([lng]))
+    top = max(y[0] * world - height / 2, 0.0) / world
+    bottom = min(y[0] * world + height / 2, world) / world
+    north, south = np.degrees(
+        np.arctan(np.sinh(np.pi * (1 - 2 * np.array([top, bottom]))))
+    )
+    half_width = width / 2 / world * 360.0
+    return [[float(south), lng - half_width], [float(north), lng + half_width]]
+
+
+def expansion_zoom(hierarchy, zoom):
+    """Zoom to jump to when a cluster of the zoom level is clicked"""
+    return min(cluster_level(hierarchy, zoom) + 2, MAX_CLUSTER_ZOOM + 1)
+
+
+def clusters_geojson(hierarchy, city_lookup: pd.DataFrame, zoom, bounds=None):
+    """GeoJSON points of the clusters and single cities inside the bounds"""
+    level_zoom = cluster_level(hierarchy, zoom)
+    level = hierarchy[level_zoom]
+    features = []
+    for i in clusters_in_bounds(hierarchy, level_zoom, bounds):
+        city_id = int(level["city_id"][i])
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [
+                        round(float(level["lng"][i]), 4),
+                        round(float(level["lat"][i]), 4),
+                    ],
+                },
+                "properties": {
+                    "cluster_id": f"{level_zoom}_{i}",
+                    "count": int(level["count"][i]),
+                    "city_id": city_id,
+                    "name": city_lookup["city"].iat[city_id]
+                    + ", "
+                    + city_lookup["country"].iat[city_id],
+                },
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def register_cluster_api(server: flask.Flask, hierarchy, city_lookup: pd.DataFrame):
+    """
+    GET /api/clusters?zoom=5&bbox=west,south,east,north returns the clusters
+    of the zoom level inside the bounding box as GeoJSON
+    """
+
+    @server.route("/api/clusters")
+    def _clusters():
+        try:
+            zoom = float(flask.request.args.get("zoom", 0))
+            bbox = flask.request.args.get("bbox")
+            bounds = None
+            if bbox:
+                west, south, east, north = [float(v) for v in bbox.split(",")]
+                bounds = [[south, west], [north, east]]
+        except ValueError:
+            flask.abort(400)
+
+        return flask.Response(
+            json.dumps(clusters_geojson(hierarchy, city_lookup, zoom, bounds)),
+            mimetype="application/json",
+        )
@@ -0,0 +1,70 @@
+"""
+Day of year climatology of every city, computed once per dataset version.
+
+For each city and day of year slot (see process_city_data.day_of_year_slots):
+the BASELINE mean, the 10th and 90th percentiles of the baseline days within
++-WINDOW_DAYS of the slot, and the record high and low over the whole record.
+All cities are reshaped to (cities x years x 366) and reduced along the years
+axis in one vectorised pass per block of cities, so a chart only has to index
+the arrays by day of year.
+"""
+
+import warnings
+
+import numpy as np
+
+from process_city_data import year_doy_matrix
+from process_data import derived
+
+BASELINE = (1981, 2010)
+# Fall back to the whole record when the dataset has fewer baseline years
+MIN_BASELINE_YEARS = 10
+WINDOW_DAYS = 2
+CITY_BLOCK = 16
+
+
+def compute_climatology(dates: np.ndarray, temperatures: np.ndarray):
+    """Climatology arrays of a (cities x days) temperature matrix"""
+    n_cities = len(temperatures)
+    climatology = {
+        name: np.empty((n_cities, 366), dtype=np.float32)
+        for name in ("mean", "p10", "p90", "record_high", "record_low")
+    }
+
+    for block in range(0, n_cities, CITY_BLOCK):
+        years, matrix = year_doy_matrix(
+            dates, np.asarray(temperatures[block : block + CITY_BLOCK])
+        )
+        in_baseline = (years >= BASELINE[0]) & (years <= BASELINE[1])
+        if in_baseline.sum() < MIN_BASELINE_YEARS:
+            in_baseline[:] = True
+        baseline = matrix[:, in_baseline]
+        # Pool the neighbouring days so the percentiles are not too noisy
+        window = np.concatenate(
+            [
+                np.roll(baseline, shift, axis=2)
+                for shift in range(-WINDOW_DAYS, WINDOW_DAYS + 1)
+            ],
+            axis=1,
+        )
+
+        rows = slice(block, block + len(matrix))
+        with warnings.catch_warnings():
+            # Slots without any data, 29 February or a city with gaps, are NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            climatology["mean"][rows] = np.nanmean(baseline, axis=1)
+            climatology["p10"][rows], climatology["p90"][rows] = np.nanpercentile(
+                window, [10, 90], axis=1
+            )
+            climatology["record_high"][rows] = np.nanmax(matrix, axis=1)
+            climatology["record_low"][rows] = np.nanmin(matrix, axis=1)
+
+    climatology["baseline"] = np.array(
+        [years[in_baseline].min(), years[in_baseline].max()]
+    )
+    return climatology
+
+
+def load_climatology():
+    """Climatology arrays of the current dataset, computed on first use"""
+    return derived("climatology", compute_climatology)
@@ -0,0 +1,17 @@
+"""
+Test settings, imported by pytest before any test module so every module
+sees them when it first imports process_data or the app.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+# Run on the small generated dataset, see make_fixture.py
+os.environ.setdefault("GLOBAL_TEMPS_FIXTURE", "1")
+if "GLOBAL_TEMPS_FIGURE_DIR" not in os.environ:
+    os.environ["GLOBAL_TEMPS_FIGURE_DIR"] = tempfile.mkdtemp(prefix="figures_")
+    atexit.register(
+        shutil.rmtree, os.environ["GLOBAL_TEMPS_FIGURE_DIR"], ignore_errors=True
+    )
@@ -0,0 +1,111 @@
+"""
+Data quality arrays computed once per dataset version.
+
+For every city and year: the number of valid days and the longest run of
+missing days. For every city and day: an outlier flag, set when the value is
+further than OUTLIER_MADS scaled median absolute deviations from the city's
+median for that calendar month. Flags are bit packed.
+
+The arrays are saved as quality.npz in the dataset store so they are only
+computed when the dataset changes.
+"""
+
+import numpy as np
+
+from process_city_data import period_starts
+from process_data import derived, load_dataset
+
+# A year with more valid days counts as complete in the yearly averages
+COMPLETE_YEAR_DAYS = 350
+# A year with a longer run of missing days is drawn as having gaps
+MAX_GAP_DAYS = 14
+OUTLIER_MADS = 6
+CITY_BLOCK = 64
+
+
+def _longest_gaps(missing: np.ndarray, starts: np.ndarray):
+    """Longest run of missing days in each period of a (cities x days) mask"""
+    day = np.arange(missing.shape[1])
+    boundary = np.zeros(missing.shape[1], dtype=bool)
+    boundary[starts] = True
+    # Index of the last valid day, or the day before a period starts, so runs
+    # restart at each period
+    last_break = np.where(~missing, day, np.where(boundary, day - 1, -1))
+    run = day - np.maximum.accumulate(last_break, axis=1)
+    return np.maximum.reduceat(run, starts, axis=1)
+
+
+def _outliers(block: np.ndarray, months: np.ndarray):
+    """Flag values far from the median of their calendar month"""
+    flags = np.zeros(block.shape, dtype=bool)
+    for month in range(1, 13):
+        in_month = months == month
+        values = block[:, in_month]
+        if values.shape[1] == 0:
+            continue
+        median = np.nanmedian(values, axis=1, keepdims=True)
+        mad = 1.4826 * np.nanmedian(np.abs(values - median), axis=1, keepdims=True)
+        with np.errstate(invalid="ignore"):
+            flags[:, in_month] = np.abs(values - median) > OUTLIER_MADS * np.fmax(
+                mad, 0.5
+            )
+    return flags
+
+
+def compute_quality(dates: np.ndarray, temperatures: np.ndarray):
+    """Quality arrays of a (cities x days) temperature matrix, a block of cities at a time"""
+    years, starts = period_starts(dates, "yearly")
+    months = dates.astype("datetime64[M]").astype(int) % 12 + 1
+    n_cities = len(temperatures)
+
+    valid_days = np.empty((n_cities, len(years)), dtype=np.uint16)
+    longest_gap = np.empty((n_cities, len(years)), dtype=np.uint16)
+    outliers = np.empty((n_cities, (len(dates) + 7) // 8), dtype=np.uint8)
+    for block in range(0, n_cities, CITY_BLOCK):
+        values = np.asarray(temperatures[block : block + CITY_BLOCK])
+        missing = np.isnan(values)
+        rows = slice(block, block + len(values))
+        valid_days[rows] = np.add.reduceat(~missing, starts, axis=1)
+        longest_gap[rows] = _longest_gaps(missing, starts)
+        outliers[rows] = np.packbits(_outliers(values, months), axis=1)
+
+    return {
+        "years": years.astype(int) + 1970,
+        "days_in_year": np.diff(np.r_[starts, len(dates)]).astype(np.uint16),
+        "valid_days": valid_days,
+        "longest_gap": longest_gap,
+        "outliers": outliers,
+    }
+
+
+def load_quality():
+    """Quality arrays of the current dataset, computed on first use"""
+    return derived("quality", compute_quality)
+
+
+def complete_years(city_id: int, min_days: int = COMPLETE_YEAR_DAYS, quality=None):
+    """
+    Years of the city with more than min_days valid days. quality defaults
+    to the arrays of the cities, pass another set for aggregate series.
+    """
+    quality = load_quality() if quality is None else quality
+    return quality["years"][quality["valid_days"][city_id] > min_days]
+
+
+def gap_years(city_id: int, max_gap: int = MAX_GAP_DAYS, quality=None):
+    """Years of the city with a run of more than max_gap missing days"""
+    quality = load_quality() if quality is None else quality
+    return quality["years"][quality["longest_gap"][city_id] > max_gap]
+
+
+def missing_days(city_id: int, quality=None):
+    """Years and missing days of each year of the city"""
+    quality = load_quality() if quality is None else quality
+    return quality["years"], quality["days_in_year"] - quality["valid_days"][city_id]
+
+
+def outlier_mask(city_id: int, quality=None):
+    """Bool mask over the dates of the days flagged as outliers"""
+    quality = load_quality() if quality is None else quality
+    dates, _temperatures, _meta = load_dataset()
+    return np.unpackbits(quality["outliers"][city_id], count=len(dates)).astype(bool)
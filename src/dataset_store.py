@@ -0,0 +1,151 @@
+"""
+Binary dataset store kept next to the wide csv.
+
+<csv name>.store/
+    dates.npy         datetime64[D] date of each day, shared by all cities
+    temperatures.npy  float32 (cities x days), NaN where a day is missing
+    cities.npz        typed city lookup, see process_data.save_city_lookup
+    meta.json         shape, date range, a content hash used as version and the
+                      size and mtime of the csv the store was built from
+
+A city is one contiguous row of temperatures.npy so reading one city, or a
+window of days of one city, from the memory map only touches those pages.
+"""
+
+import errno
+import functools
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+TEMPERATURES_FILE = "temperatures.npy"
+DATES_FILE = "dates.npy"
+CITIES_FILE = "cities.npz"
+META_FILE = "meta.json"
+
+
+def store_path(filename: str):
+    """Store directory for the csv"""
+    return os.path.splitext(filename)[0] + ".store"
+
+
+def create_store(path: str, dates: np.ndarray, n_cities: int):
+    """
+    Start writing a store into a temporary directory next to path. Returns the
+    temporary directory and a writable (cities x days) memory map filled with
+    NaN. Fill it a block of cities at a time then call commit_store.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, DATES_FILE), dates.astype("datetime64[D]"))
+    temperatures = np.lib.format.open_memmap(
+        os.path.join(tmp_path, TEMPERATURES_FILE),
+        mode="w+",
+        dtype=np.float32,
+        shape=(n_cities, len(dates)),
+    )
+    temperatures[:] = np.nan
+    return tmp_path, temperatures
+
+
+def _content_hash(tmp_path: str, temperatures: np.ndarray, block_rows=64):
+    digest = hashlib.sha1()
+    for name in (DATES_FILE, CITIES_FILE):
+        with open(os.path.join(tmp_path, name), "rb") as f:
+            digest.update(f.read())
+    for start in range(0, temperatures.shape[0], block_rows):
+        digest.update(np.ascontiguousarray(temperatures[start : start + block_rows]))
+    return digest.hexdigest()[:16]
+
+
+def source_stat(filename: str):
+    """Size and mtime of the csv, recorded in meta.json to spot a changed csv"""
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def commit_store(tmp_path: str, path: str, temperatures: np.ndarray, source: str):
+    """
+    Flush the temperatures, write meta.json and move the store into place.
+    cities.npz must already be in tmp_path and source, the csv the store
+    matches, already written. Readers holding the old store keep their memory
+    maps of the replaced files.
+    """
+    temperatures.flush()
+    dates = np.load(os.path.join(tmp_path, DATES_FILE))
+    meta = {
+        "version": _content_hash(tmp_path, temperatures),
+        "n_cities": int(temperatures.shape[0]),
+        "n_days": int(temperatures.shape[1]),
+        "first_date": str(dates[0]) if len(dates) else None,
+        "last_date": str(dates[-1]) if len(dates) else None,
+        "source": source_stat(source),
+    }
+    with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=4)
+
+    old_path = f"{path}.{os.getpid()}.old"
+    while True:
+        try:
+            os.replace(tmp_path, path)
+            break
+        except OSError as error:
+            if error.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+        # Another process may commit its store between the two renames, so
+        # move whatever is in place aside and try again
+        shutil.rmtree(old_path, ignore_errors=True)
+        try:
+            os.replace(path, old_path)
+        except FileNotFoundError:
+            pass
+    shutil.rmtree(old_path, ignore_errors=True)
+    return meta
+
+
+def store_is_current(path: str, filename: str):
+    """True when the store exists and was built from the csv as it is now"""
+    try:
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return False
+    return meta.get("source") == source_stat(filename)
+
+
+@functools.lru_cache(maxsize=None)
+def load_store(path: str):
+    """
+    Dates, read only memory map of the temperatures and meta data of a store.
+    Cached so every caller in the process shares the same maps.
+    """
+    with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+    dates = np.load(os.path.join(path, DATES_FILE))
+    temperatures = np.load(os.path.join(path, TEMPERATURES_FILE), mmap_mode="r")
+    return dates, temperatures, meta
+
+
+def load_derived(path: str, name: str, version: str, compute):
+    """
+    Arrays derived from a store, saved in it as <name>.npz. compute() is only
+    called when the file is missing or was made from another dataset version.
+    """
+    filename = os.path.join(path, f"{name}.npz")
+    if os.path.exists(filename):
+        with np.load(filename) as derived:
+            if str(derived["version"]) == version:
+                return {k: derived[k] for k in derived.files}
+
+    derived = compute()
+    derived["version"] = np.array(version)
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as f:
+        np.savez(f, **derived)
+    os.replace(tmp_filename, filename)
+    return derived
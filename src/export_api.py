@@ -0,0 +1,195 @@
+"""
+Bulk export of the temperature matrix for data consumers.
+
+    GET /api/export/temperatures.arrow?cities=all&agg=daily
+    GET /api/export/temperatures.parquet?cities=0,8,42&agg=monthly&start=2000-01-01
+
+Streams a wide table, a date column then one float32 column per city named by
+its index, as an Arrow IPC stream or a Parquet file. Missing days are NaN.
+Daily batches wrap the contiguous rows of the memory mapped store, monthly
+batches the rows of the monthly_stats array and yearly batches those of
+yearly.npz, saved in the store once per dataset version, without copying
+them. Batches are written out one at a time, so memory per request stays
+constant whatever the number of cities and days.
+"""
+
+import flask
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from city_api import AGGREGATIONS, parse_city_ids
+from monthly_stats import load_monthly
+from process_city_data import period_means, period_starts
+from process_data import (
+    build_reduced_city_lookup,
+    date_rows,
+    derived,
+    load_dataset,
+)
+
+BATCH_ROWS = 1024
+CITY_BLOCK = 64
+EXPORT_FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class _ChunkSink:
+    """Write only file object holding what pyarrow wrote until it is drained"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def compute_yearly(dates: np.ndarray, temperatures: np.ndarray):
+    """Yearly means of a (cities x days) temperature matrix"""
+    labels, starts = period_starts(dates, "yearly")
+    means = np.empty((len(temperatures), len(labels)), dtype=np.float32)
+    for block in range(0, len(temperatures), CITY_BLOCK):
+        means[block : block + CITY_BLOCK] = period_means(
+            temperatures[block : block + CITY_BLOCK], starts
+        )
+    return {"labels": labels, "means": means}
+
+
+def load_yearly():
+    """Yearly means of every city of the current dataset, computed on first use"""
+    return derived("yearly", compute_yearly)
+
+
+def period_matrix(agg: str):
+    """
+    Labels and (cities x periods) float32 monthly or yearly means of every
+    city over the periods of the record. Monthly means are a view of the
+    (cities x years x 12) monthly_stats array.
+    """
+    if agg == "yearly":
+        yearly = load_yearly()
+        return yearly["labels"], yearly["means"]
+
+    dates, _temperatures, _meta = load_dataset()
+    monthly = load_monthly()
+    labels = np.arange(
+        dates[0].astype("datetime64[M]"), dates[-1].astype("datetime64[M]") + 1
+    )
+    first = int(labels[0].astype(np.int64)) - (int(monthly["years"][0]) - 1970) * 12
+    means = monthly["means"].reshape(len(monthly["means"]), -1)
+    return labels, means[:, first : first + len(labels)]
+
+
+def _schema(city_ids):
+    return pa.schema(
+        [("date", pa.date32())] + [(str(c), pa.float32()) for c in city_ids]
+    )
+
+
+def daily_batches(city_ids, start=None, end=None, batch_rows=BATCH_ROWS):
+    """Record batches of days, each city column a view of its row in the store"""
+    dates, temperatures, _meta = load_dataset()
+    first, last = date_rows(dates, start, end)
+    schema = _schema(city_ids)
+    for row in range(first, last, batch_rows):
+        stop = min(row + batch_rows, last)
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(dates[row:stop], type=pa.date32())]
+            + [pa.array(temperatures[c, row:stop]) for c in city_ids],
+            schema=schema,
+        )
+
+
+def aggregate_batches(city_ids, agg, start=None, end=None, batch_rows=BATCH_ROWS):
+    """
+    Record batches of monthly or yearly means sliced from the precomputed
+    period matrix. start and end select the whole periods containing them.
+    """
+    labels, means = period_matrix(agg)
+    if start is not None:
+        # Keep the period start falls in
+        start = np.datetime64(start, "D").astype(labels.dtype)
+    first, last = date_rows(labels, start, end)
+
+    schema = _schema(city_ids)
+    period_dates = labels.astype("datetime64[D]")
+    for row in range(first, last, batch_rows):
+        stop = min(row + batch_rows, last)
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(period_dates[row:stop], type=pa.date32())]
+            + [pa.array(means[c, row:stop]) for c in city_ids],
+            schema=schema,
+        )
+
+
+def stream_batches(batches, schema: pa.Schema, output_format: str):
+    """Write batches to Arrow IPC or Parquet, yielding the bytes after each one"""
+    sink = _ChunkSink()
+    if output_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    for batch in batches:
+        if output_format == "parquet":
+            writer.write_table(pa.Table.from_batches([batch], schema))
+        else:
+            writer.write_batch(batch)
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+def register_export_api(server: flask.Flask):
+    @server.route("/api/export/temperatures.<output_format>")
+    def _export(output_format):
+        args = flask.request.args
+        agg = args.get("agg", "daily")
+        try:
+            city_ids = parse_city_ids(
+                args.get("cities", "all"),
+                len(build_reduced_city_lookup()),
+                max_cities=np.iinfo(np.int32).max,
+            )
+            if agg not in AGGREGATIONS or output_format not in EXPORT_FORMATS:
+                raise ValueError(agg, output_format)
+            start, end = args.get("start") or None, args.get("end") or None
+            date_rows(load_dataset()[0], start, end)
+        except LookupError:
+            flask.abort(404)
+        except ValueError:
+            flask.abort(400)
+
+        if agg == "daily":
+            batches = daily_batches(city_ids, start, end)
+        else:
+            batches = aggregate_batches(city_ids, agg, start, end)
+
+        return flask.Response(
+            stream_batches(batches, _schema(city_ids), output_format),
+            mimetype=EXPORT_FORMATS[output_format],
+            headers={
+                "Content-Disposition": f"attachment; filename=temperatures_{agg}.{output_format}"
+            },
+        )
@@ -0,0 +1,142 @@
+"""
+Persistent store of the chart figures, shared by every worker.
+
+    <GLOBAL_TEMPS_FIGURE_DIR>/<dataset version>/<chart>-<code hash>/<series key>_<unit>.json
+
+A figure is saved as its plotly JSON, which does not depend on the plotly or
+python version the way a pickle of go.Figure does, and is returned as the
+parsed dict Dash sends to the browser. Figures are keyed by the dataset
+version so a new dataset never serves old figures, and by a hash of the
+chart function source so a deploy changing a chart does not either.
+
+Files are written to a temporary name and renamed into place, so workers on
+one or many hosts sharing the directory only ever read whole figures. A hit
+touches the file's mtime; once the store is over its size cap, the least
+recently used figures are deleted, figures of older dataset versions first
+since they are never read again, down to LOW_WATER of the cap so the next
+scan of the directory only comes after that much more has been written.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import re
+import threading
+
+import plotly.graph_objs as go
+
+FIGURE_DIR = os.environ.get(
+    "GLOBAL_TEMPS_FIGURE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "figures"),
+)
+MAX_MEGABYTES = float(os.environ.get("GLOBAL_TEMPS_FIGURE_CACHE_MB", 512))
+LOW_WATER = 0.9
+
+
+def _source_hash(func):
+    return hashlib.sha1(inspect.getsource(func).encode("utf-8")).hexdigest()[:8]
+
+
+class FigureStore:
+    """
+    Figures of the charts of one dataset version. path=None disables the
+    store, like joblib.Memory(None), and every call builds the figure, as do
+    calls while bypass() returns True.
+    """
+
+    def __init__(
+        self, path, version: str, max_bytes=MAX_MEGABYTES * 2**20, bypass=None
+    ):
+        self.path = path
+        self.version = version
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self._size = None
+        self._lock = threading.Lock()
+
+    def filename(self, chart: str, key: str, is_fahrenheit: bool):
+        unit = "F" if is_fahrenheit else "C"
+        return os.path.join(self.path, self.version, chart, f"{key}_{unit}.json")
+
+    def get(self, filename: str):
+        """Parsed figure or None when it is not in the store"""
+        try:
+            with open(filename, "rb") as f:
+                figure = json.loads(f.read())
+            os.utime(filename)
+        except (FileNotFoundError, ValueError):
+            return None
+        return figure
+
+    def put(self, filename: str, figure: go.Figure):
+        """Save the figure atomically and return the stored figure"""
+        data = figure.to_json().encode("utf-8")
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(data)
+        os.replace(tmp_filename, filename)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            if self._size is None or self._size > self.max_bytes:
+                self.evict()
+        return json.loads(data)
+
+    def _entries(self):
+        for root, _dirs, files in os.walk(self.path):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                filename = os.path.join(root, name)
+                try:
+                    stat = os.stat(filename)
+                except FileNotFoundError:
+                    continue
+                is_current = os.path.relpath(root, self.path).startswith(self.version)
+                yield (is_current, stat.st_mtime), stat.st_size, filename
+
+    def evict(self):
+        """Delete least recently used figures down to the low water mark"""
+        entries = sorted(self._entries())
+        size = sum(entry_size for _key, entry_size, _filename in entries)
+        for _key, entry_size, filename in entries:
+            if size <= self.max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        # Figures other workers write from now on are counted at the next scan
+        self._size = size
+
+    def cache(self, func):
+        """
+        Decorate a chart function of (city_country, is_fahrenheit) returning a
+        go.Figure. func is kept as .func to build a figure without the store.
+        """
+        if self.path is None:
+            func.func = func
+            return func
+
+        chart = f"{func.__name__}-{_source_hash(func)}"
+
+        @functools.wraps(func)
+        def cached(city_country, is_fahrenheit):
+            # The key comes from the browser, keep it inside the store
+            if not re.fullmatch(r"\w+", city_country):
+                raise LookupError(city_country)
+            if self.bypass is not None and self.bypass():
+                return func(city_country, is_fahrenheit)
+            filename = self.filename(chart, city_country, bool(is_fahrenheit))
+            figure = self.get(filename)
+            if figure is None:
+                figure = self.put(filename, func(city_country, is_fahrenheit))
+            return figure
+
+        cached.func = func
+        return cached
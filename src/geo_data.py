@@ -1,42 +1,96 @@
-def gen_geocode_get_lat_long_file():
+import json
+import os
+import time
+import urllib.parse
+import urllib.request
+
+geocode_cache_filename = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "..", "data", "cities_lat_long.json"
+)
+
+
+def load_geocode_cache(filename: str = geocode_cache_filename):
+    """Cached geocode.xyz responses keyed by "City, Country" or "City, State, Country" """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_geocode_cache(geocode_cache: dict, filename: str = geocode_cache_filename):
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        json.dump(geocode_cache, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_filename, filename)
+
+
+def cached_lat_long(geocode_cache: dict, key: str):
+    """(lat, lng) of a cached response or None if missing or unusable"""
+    response = geocode_cache.get(key)
+    try:
+        return float(response["latt"]), float(response["longt"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def local_geocoder(key: str):
+    """Offline stub, never finds anything so only the cache is used"""
+    return None
+
+
+def geocode_xyz_geocoder(key: str, min_interval: float = 5):
     """
     Geocode.xyz uses only open data sources, including but not limited to OpenStreetMap, Geonames, Osmnames, openaddresses.io, UK Ordnance Survey, www.dati.gov.it, data.europa.eu/euodp/en/data, PSMA Geocoded National Address File (Australia), etc..
     You may cache our geocodes, display results on any map, store them however you want for as long as you want, use them however you want, even commercially - unless you wish to resell our services.
+
+    The free api is throttled so calls are spaced by min_interval seconds.
+    """
+    wait = geocode_xyz_geocoder.last_call + min_interval - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+    geocode_xyz_geocoder.last_call = time.monotonic()
+
+    url = f"https://geocode.xyz/{urllib.parse.quote(key)}?json=True"
+    print(url)
+    try:
+        with urllib.request.urlopen(url) as url_responce:
+            return json.loads(url_responce.read().decode())
+    except (OSError, ValueError) as e:
+        print("geocode failed", key, e)
+        return None
+
+
+geocode_xyz_geocoder.last_call = 0.0
+
+geocoders = {
+    "local": local_geocoder,
+    "geocode.xyz": geocode_xyz_geocoder,
+}
+
+
+def geocode_keys(city: str, admin_name: str, country: str):
+    """
+    Cache keys to try for a city, most specific first. admin_name is skipped
+    when empty or NaN, as pandas reads a blank cell.
+    """
+    keys = [f"{city}, {country}"]
+    if isinstance(admin_name, str) and admin_name.strip():
+        keys.insert(0, f"{city}, {admin_name}, {country}")
+    return keys
+
+
+def lookup_lat_long(geocode_cache: dict, keys, geocoder=local_geocoder):
+    """
+    Find the coordinates of a city in the cache, asking the geocoder for the
+    first key on a miss. New responses are added to the cache.
     """
+    for key in keys:
+        lat_long = cached_lat_long(geocode_cache, key)
+        if lat_long is not None:
+            return lat_long
 
-    df = preprocess(load_data)
-
-    df["web_key"] = (
-        df["City"].astype("string")
-        + ","
-        + np.where(df["State"].isnull(), "", df["State"].astype("string") + ",")
-        + df["Country"].astype("string")
-    )
-
-    country_cities = df[
-        ["Country", "State", "City", "CityCountry", "web_key"]
-    ].drop_duplicates()
-
-    print(country_cities)
-
-    all_data = {}
-    with open("cities_lat_long.json", "r", encoding="utf-8") as f:
-        all_data = json.load(f)
-
-    for _i, row in country_cities.iterrows():
-        country_query = urllib.parse.quote(row["web_key"])
-        print(country_query)
-        if str(row["CityCountry"]) not in all_data:
-            url = f"https://geocode.xyz/{country_query}?json=True"
-            print(url)
-
-            try:
-                with urllib.request.urlopen(url) as url_responce:
-                    data = json.loads(url_responce.read().decode())
-                    print(data)
-                    all_data[str(row["CityCountry"])] = data
-                with open("cities_lat_long.json", "w", encoding="utf-8") as f:
-                    json.dump(all_data, f, ensure_ascii=False, indent=4)
-                time.sleep(5)
-            except:
-                time.sleep(60)
+    response = geocoder(keys[0])
+    if response is None:
+        return None
+    geocode_cache[keys[0]] = response
+    return cached_lat_long(geocode_cache, keys[0])
@@ -0,0 +1,256 @@
+"""
+Build the dataset from local raw inputs.
+
+    python src/ingest.py --cities worldcities.csv --series-dir raw/
+
+--cities is a simplemaps style table (city, city_ascii, lat, lng, country,
+iso2, iso3, admin_name, capital, population, id). Each city with a raw series
+file <series-dir>/<id>.csv (first column a timestamp, second the air
+temperature in °C, daily or hourly) is ingested. Missing coordinates are
+filled from the local geocode cache, the remote geocoder is only asked when
+--geocoder names one.
+
+Cities are read, resampled to daily means and validated in chunks by a pool
+of worker processes and written straight into the memory mapped store, so
+memory is bounded by the chunk size. The wide csv the app reads and its city
+lookup sidecar are written from the store at the end.
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_store import CITIES_FILE, commit_store, create_store, store_path
+from geo_data import (
+    geocoders,
+    geocode_cache_filename,
+    geocode_keys,
+    load_geocode_cache,
+    lookup_lat_long,
+    save_geocode_cache,
+)
+from process_data import (
+    all_filenames,
+    city_lookup_arrays,
+    city_lookup_path,
+    save_city_lookup,
+)
+
+# Rows above the temperatures in the wide csv, see process_data.CITY_INFO_ROWS
+CITY_INFO_NAMES = [
+    "city",
+    "city_ascii",
+    "lat",
+    "lng",
+    "country",
+    "iso2",
+    "iso3",
+    "admin_name",
+    "capital",
+    "population",
+    "id",
+    "datetime",
+]
+MIN_TEMPERATURE = -90.0
+MAX_TEMPERATURE = 60.0
+
+
+def series_filename(series_dir: str, city_id):
+    return os.path.join(series_dir, f"{city_id}.csv")
+
+
+def read_series(filename: str):
+    """Daily mean temperature of a raw series file"""
+    raw = pd.read_csv(filename, usecols=[0, 1])
+    dates = pd.to_datetime(raw.iloc[:, 0]).dt.floor("D")
+    temperatures = pd.to_numeric(raw.iloc[:, 1], errors="coerce").astype(np.float32)
+    return temperatures.groupby(dates.to_numpy()).mean()
+
+
+def series_span(filename: str):
+    """
+    First and last day of a raw series file. Only the date column is parsed,
+    the rows need not be sorted.
+    """
+    try:
+        dates = pd.to_datetime(pd.read_csv(filename, usecols=[0]).iloc[:, 0])
+    except ValueError as error:
+        raise ValueError(f"Unreadable series {filename}: {error}") from error
+    if dates.isnull().all():
+        raise ValueError(f"No dates in series {filename}")
+    return (
+        np.datetime64(dates.min().date()),
+        np.datetime64(dates.max().date()),
+    )
+
+
+def load_chunk(filenames, first_date: np.datetime64, n_days: int):
+    """
+    Read and validate the series of a chunk of cities into a (cities x days)
+    float32 block. Values outside the plausible air temperature range are
+    dropped. Runs in a worker process.
+    """
+    block = np.full((len(filenames), n_days), np.nan, dtype=np.float32)
+    out_of_range = np.zeros(len(filenames), dtype=np.int64)
+    for row, filename in enumerate(filenames):
+        series = read_series(filename)
+        day = (series.index.to_numpy().astype("datetime64[D]") - first_date).astype(
+            np.int64
+        )
+        in_window = (day >= 0) & (day < n_days)
+        block[row, day[in_window]] = series.to_numpy()[in_window]
+
+    invalid = (block < MIN_TEMPERATURE) | (block > MAX_TEMPERATURE)
+    out_of_range += invalid.sum(axis=1)
+    block[invalid] = np.nan
+    return block, out_of_range
+
+
+def load_chunks(executor, filenames, chunk_size: int, max_pending: int, *args):
+    """
+    Yield (start, load_chunk result) for each chunk of the filenames as it
+    completes. At most max_pending chunks are submitted at a time so finished
+    blocks waiting to be copied into the store do not pile up in memory.
+    """
+    starts = iter(range(0, len(filenames), chunk_size))
+    pending = {}
+    while True:
+        for start in itertools.islice(starts, max_pending - len(pending)):
+            chunk = filenames[start : start + chunk_size]
+            pending[executor.submit(load_chunk, chunk, *args)] = start
+        if not pending:
+            return
+        done, _pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            yield pending.pop(future), future.result()
+
+
+def resolve_coordinates(cities: pd.DataFrame, geocoder, geocode_cache: dict):
+    """Fill missing lat/lng from the geocode cache, dropping cities not found"""
+    missing = cities["lat"].isnull() | cities["lng"].isnull()
+    for i in cities.index[missing]:
+        lat_long = lookup_lat_long(
+            geocode_cache,
+            geocode_keys(
+                cities.at[i, "city"],
+                cities.at[i, "admin_name"] if "admin_name" in cities else "",
+                cities.at[i, "country"],
+            ),
+            geocoder,
+        )
+        if lat_long is not None:
+            cities.at[i, "lat"], cities.at[i, "lng"] = [str(v) for v in lat_long]
+
+    unresolved = cities["lat"].isnull() | cities["lng"].isnull()
+    if unresolved.any():
+        print("No coordinates for", list(cities.loc[unresolved, "city"]))
+    return cities[~unresolved].reset_index(drop=True)
+
+
+def write_wide_csv(
+    filename: str, cities: pd.DataFrame, dates, temperatures, block_days=512
+):
+    """Write the store as the wide csv: 12 rows of city info then one row per day"""
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w", encoding="utf-8", newline="") as f:
+        info = pd.DataFrame(
+            [
+                cities[name].to_numpy() if name in cities else [""] * len(cities)
+                for name in CITY_INFO_NAMES
+            ],
+            index=CITY_INFO_NAMES,
+            columns=[str(i) for i in range(len(cities))],
+        )
+        info.to_csv(f)
+        for start in range(0, len(dates), block_days):
+            block = pd.DataFrame(
+                temperatures[:, start : start + block_days].T,
+                index=pd.DatetimeIndex(dates[start : start + block_days]).strftime(
+                    "%Y-%m-%d"
+                ),
+            )
+            block.to_csv(f, header=False)
+    os.replace(tmp_filename, filename)
+
+
+def ingest(
+    cities_filename: str,
+    series_dir: str,
+    output_filename: str = all_filenames[0],
+    geocoder: str = "local",
+    geocode_cache_filename: str = geocode_cache_filename,
+    workers: int = None,
+    chunk_size: int = 64,
+):
+    cities = pd.read_csv(cities_filename, dtype=str)
+    cities = cities[
+        [os.path.exists(series_filename(series_dir, i)) for i in cities["id"]]
+    ]
+
+    geocode_cache = load_geocode_cache(geocode_cache_filename)
+    cities = resolve_coordinates(cities, geocoders[geocoder], geocode_cache)
+    if geocoder != "local":
+        save_geocode_cache(geocode_cache, geocode_cache_filename)
+
+    city_arrays = city_lookup_arrays(cities)
+    filenames = [series_filename(series_dir, i) for i in cities["id"]]
+    print(f"Ingesting {len(filenames)} cities")
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        spans = list(executor.map(series_span, filenames, chunksize=chunk_size))
+        first_date = min(s[0] for s in spans)
+        dates = np.arange(first_date, max(s[1] for s in spans) + 1)
+
+        path = store_path(output_filename)
+        tmp_path, temperatures = create_store(path, dates, len(filenames))
+        valid_days = np.zeros(len(filenames), dtype=np.int64)
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+        for start, (block, out_of_range) in load_chunks(
+            executor, filenames, chunk_size, max_pending, first_date, len(dates)
+        ):
+            temperatures[start : start + len(block)] = block
+            valid_days[start : start + len(block)] = (~np.isnan(block)).sum(axis=1)
+            for city, dropped in zip(cities["city"].iloc[start:], out_of_range):
+                if dropped:
+                    print(f"{city}: dropped {dropped} out of range values")
+
+    empty = valid_days == 0
+    assert not empty.any(), list(cities.loc[empty, "city"])
+
+    # The csv goes first, the store records its size and mtime when committed
+    write_wide_csv(output_filename, cities, dates, temperatures)
+    save_city_lookup(city_arrays, city_lookup_path(output_filename))
+    print("Wrote", output_filename)
+
+    save_city_lookup(city_arrays, os.path.join(tmp_path, CITIES_FILE))
+    meta = commit_store(tmp_path, path, temperatures, output_filename)
+    print("Store", path, meta)
+    return meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cities", required=True, help="simplemaps style cities csv")
+    parser.add_argument("--series-dir", required=True, help="dir of <id>.csv series")
+    parser.add_argument("--output", default=all_filenames[0], help="wide csv to write")
+    parser.add_argument("--geocoder", default="local", choices=sorted(geocoders))
+    parser.add_argument("--geocode-cache", default=geocode_cache_filename)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    args = parser.parse_args()
+
+    ingest(
+        args.cities,
+        args.series_dir,
+        args.output,
+        args.geocoder,
+        args.geocode_cache,
+        args.workers,
+        args.chunk_size,
+    )
@@ -0,0 +1,289 @@
+"""
+Load test replaying city clicks against the Dash callbacks.
+
+    python load_harness.py --views 500 --concurrency 8
+    python load_harness.py --url http://127.0.0.1:8000 --gunicorn-pid <master pid>
+
+A view is what the browser sends when a city marker is clicked: the
+selection callback, then every figure callback listening to the selected
+city, as found in /_dash-dependencies. Cities are picked by population rank,
+with a zipf or uniform popularity, and a view is cold, a city not viewed
+yet in this run so its figures have to be built, with probability
+--cold-ratio, else warm, a city viewed before.
+
+Without --url the app is imported and driven in this process through the
+Flask test client, with its figure store in a new temporary directory so the
+run starts cold. With --url it drives a running server; start it with an
+empty GLOBAL_TEMPS_FIGURE_DIR for the cold ratio to hold, and pass the
+gunicorn master pid to report the memory of each worker.
+
+Reports throughput, p50/p99 latency of each callback and of whole views,
+and the RSS and PSS of each process serving requests.
+"""
+
+import argparse
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from process_data import build_reduced_city_lookup
+
+UPDATE_PATH = "/_dash-update-component"
+SELECTION_OUTPUTS = [
+    ("city-name", "children"),
+    ("intermediate-value", "children"),
+    ("map", "center"),
+    ("map", "zoom"),
+]
+
+
+class AppClient:
+    """Posts to the app imported in this process through the Flask test client"""
+
+    def __init__(self, server):
+        self.client = server.test_client()
+
+    def get(self, path: str):
+        return self.client.get(path).get_json()
+
+    def post(self, path: str, body: dict):
+        response = self.client.post(path, json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+        return response.get_json()
+
+
+class UrlClient:
+    """Posts to a running server"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def get(self, path: str):
+        with urllib.request.urlopen(self.url + path) as response:
+            return json.load(response)
+
+    def post(self, path: str, body: dict):
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+
+def city_views(
+    population, n_views: int, popularity: str, zipf_s: float, cold_ratio: float, rng
+):
+    """City id of each view, cities ranked by population"""
+    rank = np.empty(len(population), dtype=np.int64)
+    rank[np.argsort(-population, kind="stable")] = np.arange(1, len(population) + 1)
+    if popularity == "zipf":
+        weights = 1 / rank.astype(float) ** zipf_s
+    else:
+        weights = np.ones(len(population))
+
+    viewed = np.zeros(len(population), dtype=bool)
+    views = []
+    for _ in range(n_views):
+        is_cold = not viewed.any() or rng.random() < cold_ratio
+        candidates = ~viewed if is_cold and not viewed.all() else viewed
+        p = np.where(candidates, weights, 0)
+        city_id = int(rng.choice(len(p), p=p / p.sum()))
+        viewed[city_id] = True
+        views.append(city_id)
+    return views
+
+
+def selection_body(city_id: int):
+    marker_id = {"index": city_id, "type": "city-marker"}
+    prop_id = json.dumps(marker_id, separators=(",", ":"), sort_keys=True)
+    return {
+        "output": f"..{'...'.join(f'{i}.{p}' for i, p in SELECTION_OUTPUTS)}..",
+        "outputs": [{"id": i, "property": p} for i, p in SELECTION_OUTPUTS],
+        "inputs": [
+            {"id": "url", "property": "pathname", "value": "/"},
+            [{"id": marker_id, "property": "n_clicks", "value": 1}],
+            [],
+            {"id": "aggregate-dropdown", "property": "value", "value": None},
+        ],
+        "changedPropIds": [f"{prop_id}.n_clicks"],
+        "state": [],
+    }
+
+
+def figure_bodies(dependencies, input_values: dict):
+    """Request bodies of the callbacks fired when intermediate-value changes"""
+    bodies = []
+    for callback in dependencies:
+        inputs = [f"{i['id']}.{i['property']}" for i in callback["inputs"]]
+        if "intermediate-value.children" not in inputs:
+            continue
+        component_id, prop = callback["output"].split(".")
+        bodies.append(
+            {
+                "output": callback["output"],
+                "outputs": {"id": component_id, "property": prop},
+                "inputs": [
+                    {"id": i["id"], "property": i["property"], "value": input_values[f]}
+                    for i, f in zip(callback["inputs"], inputs)
+                ],
+                "changedPropIds": ["intermediate-value.children"],
+                "state": [],
+            }
+        )
+    return bodies
+
+
+def run_views(client, views, dependencies, is_fahrenheit, mode, concurrency):
+    """Latency in seconds of each request, by callback output"""
+    todo = queue.Queue()
+    for city_id in views:
+        todo.put(city_id)
+    latencies = {}
+    lock = threading.Lock()
+
+    def timed(output, path, body):
+        start = time.perf_counter()
+        response = client().post(path, body)
+        with lock:
+            latencies.setdefault(output, []).append(time.perf_counter() - start)
+        return response
+
+    def worker():
+        while True:
+            try:
+                city_id = todo.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            selection = timed("selection", UPDATE_PATH, selection_body(city_id))
+            values = {
+                "intermediate-value.children": selection["response"][
+                    "intermediate-value"
+                ]["children"],
+                "my-daq-toggleswitch.value": is_fahrenheit,
+                "yearly-graph-mode.value": mode,
+            }
+            for body in figure_bodies(dependencies, values):
+                timed(body["output"], UPDATE_PATH, body)
+            with lock:
+                latencies.setdefault("view", []).append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def _status_kb(pid: int, field: str):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def _pss_kb(pid: int):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except (FileNotFoundError, PermissionError):
+        pass
+    return None
+
+
+def worker_pids(master_pid: int):
+    """Pids of the gunicorn workers, the children of the master"""
+    pids = []
+    for name in os.listdir("/proc"):
+        if name.isdigit() and _status_kb(int(name), "PPid") == master_pid:
+            pids.append(int(name))
+    return sorted(pids)
+
+
+def print_report(latencies, elapsed: float, pids):
+    n_views = len(latencies["view"])
+    n_requests = sum(len(v) for k, v in latencies.items() if k != "view")
+    print(
+        f"{n_views} views, {n_requests} requests in {elapsed:.1f}s: "
+        f"{n_views / elapsed:.1f} views/s, {n_requests / elapsed:.1f} requests/s"
+    )
+    print(f"{'callback':<60} {'p50 ms':>8} {'p99 ms':>8}")
+    for output, timings in latencies.items():
+        p50, p99 = np.percentile(np.array(timings) * 1000, [50, 99])
+        print(f"{output[:60]:<60} {p50:8.1f} {p99:8.1f}")
+
+    print(f"{'pid':<10} {'rss MB':>8} {'pss MB':>8}")
+    for pid in pids:
+        rss, pss = _status_kb(pid, "VmRSS"), _pss_kb(pid)
+        print(
+            f"{pid:<10} {(rss or 0) / 1024:8.1f} "
+            + (f"{pss / 1024:8.1f}" if pss is not None else f"{'-':>8}")
+        )
+
+
+def main(args):
+    if args.url:
+        url_client = UrlClient(args.url)
+
+        def client():
+            return url_client
+
+        pids = worker_pids(args.gunicorn_pid) if args.gunicorn_pid else []
+    else:
+        os.environ.setdefault(
+            "GLOBAL_TEMPS_FIGURE_DIR", tempfile.mkdtemp(prefix="figures_")
+        )
+        import app
+
+        local = threading.local()
+
+        def client():
+            if not hasattr(local, "client"):
+                local.client = AppClient(app.server)
+            return local.client
+
+        pids = [os.getpid()]
+
+    rng = np.random.default_rng(args.seed)
+    population = build_reduced_city_lookup()["population"].to_numpy()
+    views = city_views(
+        population, args.views, args.popularity, args.zipf_s, args.cold_ratio, rng
+    )
+    dependencies = client().get("/_dash-dependencies")
+
+    start = time.perf_counter()
+    latencies = run_views(
+        client, views, dependencies, args.fahrenheit, args.mode, args.concurrency
+    )
+    print_report(latencies, time.perf_counter() - start, pids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="server to drive, in process when not set")
+    parser.add_argument("--gunicorn-pid", type=int, help="master pid of --url")
+    parser.add_argument("--views", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--popularity", choices=["zipf", "uniform"], default="zipf")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--cold-ratio", type=float, default=0.2)
+    parser.add_argument("--fahrenheit", action="store_true")
+    parser.add_argument("--mode", choices=["lines", "heatmap"], default="lines")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
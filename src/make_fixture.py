@@ -0,0 +1,72 @@
+"""
+Generate the small fixture dataset used by the tests.
+
+    python make_fixture.py
+
+Writes data/fixture/daily_temperature_fixture.csv in the same wide format as
+the full dataset: ten real cities, Los Angeles at index 8 like the app's
+starting city, from 2017 to 15 October 2020. Temperatures are a seasonal
+cycle by latitude plus seeded noise, with a long gap in one city, scattered
+missing days in another and one outlier. Set GLOBAL_TEMPS_FIXTURE=1 to make
+process_data and the app load it instead of the full csv.
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+from ingest import write_wide_csv
+from process_data import FIXTURE_FILENAME
+
+FIXTURE_CITIES = pd.read_csv(
+    io.StringIO(
+        """city,city_ascii,lat,lng,country,iso2,iso3,admin_name,capital,population,id
+Tokyo,Tokyo,35.6897,139.6922,Japan,JP,JPN,Tōkyō,primary,37977000,1392685764
+New York,New York,40.6943,-73.9249,United States,US,USA,New York,,18713220,1840034016
+Mexico City,Mexico City,19.4333,-99.1333,Mexico,MX,MEX,Ciudad de México,primary,20996000,1484247881
+Mumbai,Mumbai,18.9667,72.8333,India,IN,IND,Mahārāshtra,admin,22120000,1356226629
+São Paulo,Sao Paulo,-23.5504,-46.6339,Brazil,BR,BRA,São Paulo,admin,22046000,1076532519
+Delhi,Delhi,28.66,77.23,India,IN,IND,Delhi,admin,21106000,1356872604
+Shanghai,Shanghai,31.1667,121.4667,China,CN,CHN,Shanghai,admin,22120000,1156073548
+Cape Town,Cape Town,-33.925,18.425,South Africa,ZA,ZAF,Western Cape,primary,3433441,1710680650
+Los Angeles,Los Angeles,34.1139,-118.4068,United States,US,USA,California,,12750807,1840020491
+London,London,51.5072,-0.1275,United Kingdom,GB,GBR,"London, City of",primary,,1826645935
+"""
+    ),
+    dtype=str,
+    keep_default_na=False,
+)
+FIRST_DATE = "2017-01-01"
+LAST_DATE = "2020-10-15"
+
+
+def fixture_temperatures(cities: pd.DataFrame, dates: pd.DatetimeIndex, seed=0):
+    """(cities x days) float32 temperatures with the fixture's gaps and outlier"""
+    rng = np.random.default_rng(seed)
+    lat = cities["lat"].to_numpy(dtype=float)[:, np.newaxis]
+    season = np.cos((dates.dayofyear.to_numpy() - 200) / 365.25 * 2 * np.pi)
+    temperatures = (
+        27
+        - 0.35 * np.abs(lat)
+        + np.sign(lat) * np.abs(lat) / 5 * season
+        + rng.normal(0, 2.5, (len(cities), len(dates)))
+    ).round(1)
+
+    # New York loses 30 days of 2018, Mumbai a day here and there
+    temperatures[1, (dates >= "2018-03-01") & (dates < "2018-03-31")] = np.nan
+    temperatures[3, rng.choice(len(dates), 25, replace=False)] = np.nan
+    # A spike in Delhi for the outlier flags
+    temperatures[5, dates.get_loc("2019-06-01")] += 25
+    return temperatures.astype(np.float32)
+
+
+if __name__ == "__main__":
+    dates = pd.date_range(FIRST_DATE, LAST_DATE)
+    write_wide_csv(
+        FIXTURE_FILENAME,
+        FIXTURE_CITIES,
+        dates.values,
+        fixture_temperatures(FIXTURE_CITIES, dates),
+    )
+    print(FIXTURE_FILENAME)
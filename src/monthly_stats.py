@@ -0,0 +1,203 @@
+"""
+Monthly mean temperatures of every city as a (cities x years x 12) array.
+
+The array is computed a block of cities at a time once per dataset version
+and saved as monthly.npz in the dataset store, with the mean over all cities
+of each year and month. A city's table is the same as calc_monthly on its
+series, and questions across cities, like the warmest July in each country,
+are reductions over the array.
+
+    GET /api/monthly/<ids>?unit=c
+    GET /api/monthly/dataset?unit=c
+    GET /api/monthly/extremes?month=7&stat=max&by=country&year=2019&unit=c
+
+ids as in the city api. extremes returns the city and year with the highest
+(stat=max) or lowest (stat=min) mean of the month in each country, or in the
+whole dataset with by=dataset. year restricts it to one year.
+"""
+
+import json
+import warnings
+
+import flask
+import numpy as np
+import pandas as pd
+
+from city_api import parse_city_ids
+from process_city_data import period_means, period_starts
+from process_data import (
+    STORE_DECIMALS,
+    build_reduced_city_lookup,
+    derived,
+)
+
+CITY_BLOCK = 64
+STATS = ("max", "min")
+GROUPS = ("country", "dataset")
+
+
+def compute_monthly(dates: np.ndarray, temperatures: np.ndarray):
+    """Monthly means of a (cities x days) temperature matrix"""
+    labels, starts = period_starts(dates, "monthly")
+    year = labels.astype("datetime64[Y]").astype(int) + 1970
+    month = labels.astype(int) % 12
+    years = np.arange(year.min(), year.max() + 1)
+
+    means = np.full((len(temperatures), len(years), 12), np.nan, dtype=np.float32)
+    for block in range(0, len(temperatures), CITY_BLOCK):
+        values = np.asarray(temperatures[block : block + CITY_BLOCK])
+        means[block : block + len(values), year - years[0], month] = period_means(
+            values, starts
+        )
+
+    with warnings.catch_warnings():
+        # Months without any city, before the first day of the record
+        warnings.simplefilter("ignore", RuntimeWarning)
+        dataset_means = np.nanmean(means, axis=0)
+    return {"years": years, "means": means, "dataset_means": dataset_means}
+
+
+def load_monthly():
+    """Monthly arrays of the current dataset, computed on first use"""
+    return derived("monthly", compute_monthly)
+
+
+def monthly_table(city_id: int):
+    """Year x month means of the city, shaped like calc_monthly"""
+    monthly = load_monthly()
+    return pd.DataFrame(
+        monthly["means"][city_id].astype(np.float64).round(STORE_DECIMALS),
+        index=pd.Index(monthly["years"], name="Year"),
+        columns=pd.Index(range(1, 13), name="Month"),
+    )
+
+
+def month_extremes(month: int, stat="max", by="country", year: int = None):
+    """
+    City, year and mean of the warmest (max) or coldest (min) month in each
+    country or the whole dataset. month is 1 to 12.
+    """
+    monthly = load_monthly()
+    years = monthly["years"]
+    values = monthly["means"][:, :, month - 1]
+    if year is not None:
+        if year not in years:
+            raise LookupError(year)
+        values = values[:, years == year]
+
+    # Flip the sign for min so both are a max, missing months lose
+    signed = np.where(np.isnan(values), -np.inf, values if stat == "max" else -values)
+    best_year = signed.argmax(axis=1)
+    best = signed[np.arange(len(signed)), best_year]
+
+    city_lookup = build_reduced_city_lookup()
+    if by == "country":
+        groups = city_lookup["country"].cat.codes.to_numpy()
+    else:
+        groups = np.zeros(len(best), dtype=np.int8)
+    # Best city first within each group, then keep the first of each group
+    order = np.lexsort((-best, groups))
+    is_first = np.r_[True, groups[order][1:] != groups[order][:-1]]
+    winners = order[is_first]
+    winners = winners[np.isfinite(best[winners])]
+
+    if year is not None:
+        best_years = np.full(len(winners), year)
+    else:
+        best_years = years[best_year[winners]]
+    return pd.DataFrame(
+        {
+            "country": city_lookup["country"].to_numpy()[winners],
+            "city_id": winners,
+            "city": city_lookup["city"].to_numpy()[winners],
+            "year": best_years,
+            "value": values[winners, best_year[winners]]
+            .astype(np.float64)
+            .round(STORE_DECIMALS),
+        }
+    )
+
+
+def _to_unit(values, is_fahrenheit: bool):
+    values = np.asarray(values, dtype=np.float64)
+    if is_fahrenheit:
+        values = values / (5 / 9) + 32
+    return values.round(STORE_DECIMALS)
+
+
+def _nullable(values: np.ndarray):
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def register_monthly_api(server: flask.Flask):
+    def respond(data):
+        return flask.Response(
+            json.dumps(data, separators=(",", ":")), mimetype="application/json"
+        )
+
+    @server.route("/api/monthly/dataset")
+    def _monthly_dataset():
+        monthly = load_monthly()
+        is_fahrenheit = flask.request.args.get("unit", "c").lower() == "f"
+        return respond(
+            {
+                "years": monthly["years"].tolist(),
+                "values": _nullable(_to_unit(monthly["dataset_means"], is_fahrenheit)),
+            }
+        )
+
+    @server.route("/api/monthly/extremes")
+    def _monthly_extremes():
+        args = flask.request.args
+        try:
+            month = int(args.get("month", ""))
+            stat = args.get("stat", "max")
+            by = args.get("by", "country")
+            year = int(args["year"]) if args.get("year") else None
+            if not 1 <= month <= 12 or stat not in STATS or by not in GROUPS:
+                raise ValueError(month, stat, by)
+            extremes = month_extremes(month, stat, by, year)
+        except LookupError:
+            flask.abort(404)
+        except ValueError:
+            flask.abort(400)
+
+        extremes["value"] = _to_unit(
+            extremes["value"], args.get("unit", "c").lower() == "f"
+        )
+        return respond(
+            {
+                "month": month,
+                "stat": stat,
+                "results": json.loads(extremes.to_json(orient="records")),
+            }
+        )
+
+    @server.route("/api/monthly/<ids>")
+    def _monthly(ids):
+        city_lookup = build_reduced_city_lookup()
+        try:
+            city_ids = parse_city_ids(ids, len(city_lookup))
+        except LookupError:
+            flask.abort(404)
+        except ValueError:
+            flask.abort(400)
+
+        monthly = load_monthly()
+        is_fahrenheit = flask.request.args.get("unit", "c").lower() == "f"
+        return respond(
+            {
+                "years": monthly["years"].tolist(),
+                "cities": [
+                    {
+                        "id": city_id,
+                        "city": city_lookup["city"].iat[city_id],
+                        "country": city_lookup["country"].iat[city_id],
+                        "values": _nullable(
+                            _to_unit(monthly["means"][city_id], is_fahrenheit)
+                        ),
+                    }
+                    for city_id in city_ids
+                ],
+            }
+        )
@@ -0,0 +1,121 @@
+"""
+Colour tables of the year charts, so matplotlib is not imported at runtime.
+
+TABLES holds the 256 entry lookup table of each supported matplotlib colormap
+as packed hex rgb triples, the channels already scaled the way the charts
+format them, int(channel * 256). colors() picks table entries the way a
+matplotlib colormap does, the entry at or below the position, so the charts
+keep the exact colours they had with matplotlib. To add a colormap, with
+matplotlib installed, run
+
+    python palette.py magma viridis <name>
+
+and paste the printed tables over TABLES.
+"""
+
+import functools
+import sys
+
+import numpy as np
+
+LUT_SIZE = 256
+
+TABLES = {
+    "magma": (
+        "00000300000400000601000701010901010b02020d02020f030311040313040415050417"
+        "06051907051b08061d0907200a07220b08240c09260d0a280e0a2a0f0b2d100c2f110c31"
+        "130d33140d36150e38160e3a170f3d190f3f1a10421b10441c10461e11491f114b21114e"
+        "22115024115325115527115728115a2a115c2b115e2d11612f1063311065321067341069"
+        "360f6b370f6c390f6e3b0f703d0f713e0f72400f74420f75430f76450f77470f78481078"
+        "4a10794c107a4d117b4f117b51127c52127c54137d55147d57147e58157e5a157e5c167f"
+        "5d177f5f177f601880621980631980651a80671a80681b816a1c816b1c816d1d816e1e81"
+        "701e81711f817320817520817621817821817922827b23827c23827e2482802482812581"
+        "8325818426818627818827818928818b28818c29818e2981902a81912a81932b80942b80"
+        "962c80982c80992d809b2e7f9d2e7f9e2f7fa02f7fa1307ea3307ea5317ea6317da8327d"
+        "aa327dab337cad337caf347bb0347bb2357bb4357ab5367ab73779b93779ba3878bc3878"
+        "bd3977bf3976c13a76c23b75c43b75c63c74c73d73c93d73ca3e72cc3f71ce3f71cf4070"
+        "d1416fd2426ed4436ed5436dd7446cd8456bda466bdb476add4869de4968df4a67e14b67"
+        "e24c66e34e65e54f64e65064e75163e85362e95461ea5561ec5760ed585fee5a5fef5b5e"
+        "ef5d5ef05f5df1605df2625df3645cf3655cf4675cf5695cf66b5cf66c5cf76e5cf7705c"
+        "f8725cf8745cf9765cf9785cfa795dfa7b5dfa7d5efb7f5efb815ffb835ffc8560fc8761"
+        "fc8961fc8b62fd8c63fd8e64fd9065fd9266fd9467fe9668fe9869fe9a6afe9c6bfe9d6c"
+        "fe9f6dfea16efea36ffea570ffa772ffa973ffab74ffac76ffae77ffb078ffb27affb47b"
+        "ffb67cffb87effb97fffbb81ffbd82ffbf84ffc185ffc387ffc588ffc68affc88cffca8d"
+        "ffcc8ffece90fed092fed194fed395fed597fed799fed99bfedb9cfedc9efedea0fee0a2"
+        "fee2a3fde4a5fde6a7fde7a9fde9abfdebacfdedaefdefb0fdf1b2fdf2b4fdf4b6fdf6b8"
+        "fcf8bafcfabcfcfbbdfcfdbf"
+    ),
+    "viridis": (
+        "44015444025545035745055845065a46085b46095d460b5e460c60470e61470f62471164"
+        "47126547146648156848166948186a48196c481a6d481c6e481d6f481e70482071482173"
+        "482274482475482576482677482778472979472a79472b7a472c7b472e7c462f7d46307e"
+        "46317e46337f453480453581453681443882443983443a83433b84433c84433e85423f85"
+        "4240864141864142874143874045884046883f47883f48893e49893e4a893d4b8a3d4d8a"
+        "3c4e8a3c4f8a3b508b3b518b3a528b3a538b39548c39558c38568c38578c37588c37598c"
+        "365b8d365c8d355d8d355e8d345f8d34608d33618d33628d33638d32648e32658e31668e"
+        "31678e30688e30698e2f6a8e2f6b8e2f6c8e2e6d8e2e6e8e2d6f8e2d708e2d708e2c718e"
+        "2c728e2b738e2b748e2b758e2a768e2a778e29788e29798e297a8e287b8e287c8e287d8e"
+        "277e8e277f8e26808e26818e26828e25838e25838e25848e24858e24868e23878e23888e"
+        "23898e228a8d228b8d228c8d218d8d218e8d218f8d20908d20918c20928c20938c1f938c"
+        "1f948c1f958b1f968b1f978b1e988b1e998a1e9a8a1e9b8a1e9c891e9d891e9e891e9f88"
+        "1ea0881fa1881fa2871fa3871fa38620a48620a58621a68521a78522a88423a98323aa83"
+        "24ab8225ac8226ad8127ae8128af8029af7f2ab07f2bb17e2cb27d2eb37c2fb47c30b57b"
+        "32b67a33b77935b77936b87838b97739ba763bbb753dbc743ebd7340be7242be7144bf70"
+        "46c06f48c16e49c26d4bc26c4dc36b4fc46a51c56953c66855c66658c7655ac8645cc963"
+        "5ec96260ca6062cb5f65cc5e67cc5c69cd5b6cce5a6ece5870cf5773d05575d05477d152"
+        "7ad2517cd24f7fd34e81d44c84d44b86d54989d5488bd6468ed74490d74393d84195d83f"
+        "98d93e9bd93c9dda3aa0da39a3db37a5db35a8dc33abdc32addd30b0dd2eb3dd2db5de2b"
+        "b8de29bbdf27bddf26c0df24c3e023c5e021c8e120cbe11ecde11dd0e21cd3e21bd5e21a"
+        "d8e319dbe318dde318e0e418e2e418e5e418e8e519eae519ede51aefe61bf2e61cf4e61e"
+        "f7e61ff9e721fbe723fee724"
+    ),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _rgb_table(name: str):
+    """rgb() string of each entry of the colormap's lookup table"""
+    table = np.frombuffer(bytes.fromhex("".join(TABLES[name])), dtype=np.uint8)
+    return np.array([f"rgb({r},{g},{b})" for r, g, b in table.reshape(-1, 3)])
+
+
+def colors(name: str, positions, levels: int = None):
+    """
+    rgb() strings of the colormap at positions in [0, 1]. levels first
+    resamples the colormap to that many colours, like cm.get_cmap(name, levels).
+    """
+    positions = np.asarray(positions, dtype=float)
+    if levels is not None:
+        level = np.clip((positions * levels).astype(int), 0, levels - 1)
+        positions = level / (levels - 1)
+    index = np.clip((positions * LUT_SIZE).astype(int), 0, LUT_SIZE - 1)
+    return _rgb_table(name)[index].tolist()
+
+
+def year_colors(first_year: int, last_year: int, name="magma", low=0.25, high=0.6):
+    """
+    Colour of each year from first_year to last_year, spread evenly between
+    low and high of the colormap, so new years get colours when ingested.
+    """
+    years = range(first_year, last_year + 1)
+    return dict(zip(years, colors(name, np.linspace(low, high, len(years)))))
+
+
+def print_tables(names):
+    from matplotlib import cm
+
+    print("TABLES = {")
+    for name in names:
+        lut = cm.get_cmap(name)(np.linspace(0, 1, LUT_SIZE))[:, :3]
+        packed = "".join(
+            "%02x%02x%02x" % tuple(int(c * 256) for c in rgb) for rgb in lut
+        )
+        print(f'    "{name}": (')
+        for start in range(0, len(packed), 72):
+            print(f'        "{packed[start : start + 72]}"')
+        print("    ),")
+    print("}")
+
+
+if __name__ == "__main__":
+    print_tables(sys.argv[1:] or list(TABLES))
@@ -1,22 +1,37 @@
-from process_data import preprocess, load_data
-from render_charts import vis_data
+import pandas as pd
 
+from process_data import all_filenames, parse_city_lookup
+from stream_data import RunningStats, iter_row_blocks
 
-def print_info(df):
-    print(df.dtypes)
-    print(df.describe(datetime_is_numeric=True))
-    # print(df.Date.dt.day.explode().value_counts())
-    print(df.drop(columns=["State"]).isnull().sum())
 
-    print(df.drop(columns=["State"])[df["AvgTemperature"].isna()])
+def city_stats(filename: str, block_rows: int = 1024):
+    """Per city statistics from one streaming pass over the csv"""
+    arrays = parse_city_lookup(filename)
+    cities = arrays["city_categories"][arrays["city_codes"]]
+    countries = arrays["country_categories"][arrays["country_codes"]]
+    stats = RunningStats(len(cities))
+    first_date, last_date = None, None
+    for dates, block in iter_row_blocks(filename, block_rows):
+        stats.update(block)
+        first_date = dates[0] if first_date is None else first_date
+        last_date = dates[-1]
 
-    cites_num = len(df["City"].unique())
+    frame = stats.to_frame(index=pd.Index(cities, dtype=object) + ", " + countries)
+    frame.insert(0, "country", countries)
+    return frame, pd.Timestamp(first_date), pd.Timestamp(last_date)
+
+
+def print_info(stats: pd.DataFrame, first_date, last_date):
+    print(stats.describe())
+
+    missing = stats[stats["missing"] > 0].sort_values("missing", ascending=False)
+    print(f"{len(missing)} cities with missing days")
+    print(missing.head(20))
 
     print(
-        f"This data contains a list of daily average temperatures from {cites_num} cities and {len(df['Country'].unique())} countries."
+        f"This data contains a list of daily average temperatures from {len(stats)} cities and {stats['country'].nunique()} countries, from {first_date:%d %B, %Y} to {last_date:%d %B, %Y}."
     )
 
 
 if __name__ == "__main__":
-    df = preprocess(load_data())
-    print_info(df)
+    print_info(*city_stats(all_filenames[0]))
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd  # data processing, CSV file I/O (e.g. pd.read_csv)
 
 
@@ -9,3 +10,45 @@ def calc_monthly(city_df: pd.DataFrame):
     city_df_mean = city_df_mean.unstack()
 
     return city_df_mean
+
+
+def period_starts(dates: np.ndarray, agg: str):
+    """Label and first row of each month or year of a sorted datetime64[D] column"""
+    keys = dates.astype("datetime64[M]" if agg == "monthly" else "datetime64[Y]")
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else []
+    return keys[starts], np.asarray(starts, dtype=np.int64)
+
+
+def period_means(values: np.ndarray, starts: np.ndarray):
+    """Mean of each period along the last axis, ignoring missing days"""
+    if len(starts) == 0:
+        return np.empty(values.shape[:-1] + (0,))
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=-1)
+    counts = np.add.reduceat(valid, starts, axis=-1)
+    return np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+
+
+def day_of_year_slots(dates: np.ndarray):
+    """
+    Year and day of year slot 0-365 of a datetime64[D] column. Slot 59 is
+    29 February, so in other years 1 March onwards shift up by one and every
+    calendar day keeps the same slot across years.
+    """
+    years = dates.astype("datetime64[Y]")
+    day = (dates - years.astype("datetime64[D]")).astype(np.int64)
+    year = years.astype(np.int64) + 1970
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return year, day + (~leap & (day >= 59))
+
+
+def year_doy_matrix(dates: np.ndarray, values: np.ndarray):
+    """
+    Reshape values along the last axis into a dense (... x years x 366) array,
+    NaN where a day is missing or does not exist. Returns the years and array.
+    """
+    year, slot = day_of_year_slots(dates)
+    years = np.arange(year.min(), year.max() + 1)
+    matrix = np.full(values.shape[:-1] + (len(years), 366), np.nan, dtype=values.dtype)
+    matrix[..., year - years[0], slot] = values
+    return years, matrix
@@ -1,69 +1,130 @@
 import numpy as np  # linear algebra
 import pandas as pd  # data processing, CSV file I/O (e.g. pd.read_csv)
-import decimal, os
-from typing import List
-import json
-import urllib.request, json
-import time
-import urllib
-import json
-
-all_filenames = [
-    os.path.join(
-        os.path.dirname(os.path.realpath(__file__)),
-        "..",
-        "data",
-        "daily_temperature_1000_cities_1980_2020.csv",
-    ),
-]
+import functools
+import os
+
+from dataset_store import (
+    CITIES_FILE,
+    commit_store,
+    create_store,
+    load_derived,
+    load_store,
+    store_is_current,
+    store_path,
+)
+from stream_data import CITY_INFO_ROWS, iter_row_blocks, read_dates
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "data")
+# Small generated dataset in the same format, see make_fixture.py
+FIXTURE_FILENAME = os.path.join(DATA_DIR, "fixture", "daily_temperature_fixture.csv")
+
+if os.environ.get("GLOBAL_TEMPS_FIXTURE"):
+    all_filenames = [FIXTURE_FILENAME]
+else:
+    all_filenames = [
+        os.path.join(DATA_DIR, "daily_temperature_1000_cities_1980_2020.csv"),
+    ]
 
+# float32 keeps about 7 significant digits, round reads back to the source
+STORE_DECIMALS = 4
 
-def build_city_lookup():
+
+def city_lookup_path(filename: str):
+    """Binary sidecar holding the typed city lookup for the csv"""
+    return os.path.splitext(filename)[0] + ".cities.npz"
+
+
+def parse_city_lookup(filename: str):
     """
     First 12 rows contain information about cities and no temperture data.
-    Extract the rows and transform into useful lookup table
+    Extract the rows into typed arrays
     """
-    city_lookup = pd.read_csv(all_filenames[0], nrows=12).T
-    city_lookup.columns = city_lookup.iloc[0]
-    city_lookup = city_lookup.iloc[1:, :]
-    city_lookup["lat"] = city_lookup["lat"].astype(np.float)
-    city_lookup["lng"] = city_lookup["lng"].astype(np.float)
-    return city_lookup
+    raw = pd.read_csv(filename, nrows=CITY_INFO_ROWS, index_col=0, dtype=str).T
+    return city_lookup_arrays(raw)
 
 
-def build_reduced_city_lookup():
+def city_lookup_arrays(raw: pd.DataFrame):
     """
-    Convert city_lookup types and assert data is valid
+    Convert a frame of city, country, lat, lng and population columns into
+    typed arrays and assert data is valid
     """
-    city_lookup = build_city_lookup()
-
-    # First 12 rows are information about the cities
-    city_lookup = build_city_lookup()
-    city_lookup = city_lookup[["city", "country", "lat", "lng", "population"]]
-    city_lookup.loc[:, "population"] = (
-        city_lookup["population"].fillna(0).astype(float).astype(np.uint)
+    city = raw["city"].to_numpy(dtype=str)
+    country = raw["country"].to_numpy(dtype=str)
+    lat = raw["lat"].astype(np.float32).to_numpy()
+    lng = raw["lng"].astype(np.float32).to_numpy()
+    population = (
+        pd.to_numeric(raw["population"], errors="coerce")
+        .fillna(0)
+        .to_numpy()
+        .astype(np.uint32)
     )
 
-    assert len(city_lookup) == len(city_lookup.drop_duplicates())
-    non_null = city_lookup[["city", "country", "lat", "lng"]]
-    assert len(non_null[non_null.isnull().T.any()]) == 0, non_null[
-        non_null.isnull().T.any()
+    assert not raw[["city", "country", "lat", "lng"]].isnull().any().any(), raw[
+        raw[["city", "country", "lat", "lng"]].isnull().T.any()
     ]
+    assert len(set(zip(city, country, lat, lng))) == len(city)
+    assert ((lat >= -90) & (lat <= 90)).all()
+    assert ((lng >= -180) & (lng <= 180)).all()
+
+    city_categories, city_codes = np.unique(city, return_inverse=True)
+    country_categories, country_codes = np.unique(country, return_inverse=True)
+    return {
+        "city_codes": city_codes.astype(np.min_scalar_type(len(city_categories))),
+        "city_categories": city_categories,
+        "country_codes": country_codes.astype(
+            np.min_scalar_type(len(country_categories))
+        ),
+        "country_categories": country_categories,
+        "lat": lat,
+        "lng": lng,
+        "population": population,
+    }
+
+
+def save_city_lookup(arrays: dict, path: str):
+    """Write the typed lookup arrays, replacing any existing file atomically"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_city_lookup(path: str):
+    """Read the typed lookup arrays into a DataFrame indexed by city column"""
+    with np.load(path) as arrays:
+        return pd.DataFrame(
+            {
+                "city": pd.Categorical.from_codes(
+                    arrays["city_codes"], arrays["city_categories"]
+                ),
+                "country": pd.Categorical.from_codes(
+                    arrays["country_codes"], arrays["country_categories"]
+                ),
+                "lat": arrays["lat"],
+                "lng": arrays["lng"],
+                "population": arrays["population"],
+            }
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def build_city_lookup():
+    """
+    Typed lookup table of the cities in the csv: float32 coordinates, uint32
+    population and categorical city and country names. Parsed from the csv
+    once and then loaded from the binary sidecar file.
+    """
+    filename = all_filenames[0]
+    path = city_lookup_path(filename)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(filename):
+        save_city_lookup(parse_city_lookup(filename), path)
 
-    assert (
-        city_lookup.loc[
-            (city_lookup["lat"] < -90) | (city_lookup["lat"] > 90), "lat"
-        ].count()
-        == 0
-    )
-    assert (
-        city_lookup.loc[
-            (city_lookup["lng"] < -180) | (city_lookup["lng"] > 180), "lng"
-        ].count()
-        == 0
-    )
+    return load_city_lookup(path)
 
-    return city_lookup
+
+def build_reduced_city_lookup():
+    """City, country, lat, lng and population of each city, validated on parse"""
+    return build_city_lookup()
 
 
 def city_by_name(city_lookup, city_name: str):
@@ -74,57 +135,97 @@ def city_by_name(city_lookup, city_name: str):
     return city_by_index(city_index), city_col
 
 
-def city_by_index(city_col: int):
-    """Read only one col from the csv that contains the city we are interested in"""
-    city_data = pd.read_csv(
-        all_filenames[0],
-        skiprows=12,
-        usecols=[0, city_col + 1],
-        index_col=0,
-        parse_dates=True,
-        cache_dates=False,
-    ).iloc[:, 0]
+def build_store(filename: str, path: str, block_rows: int = 1024):
+    """Convert the wide csv into the binary store a block of days at a time"""
+    dates = read_dates(filename)
+    city_arrays = parse_city_lookup(filename)
+    tmp_path, temperatures = create_store(path, dates, len(city_arrays["lat"]))
 
-    return city_data
+    row = 0
+    for _dates, block in iter_row_blocks(filename, block_rows):
+        temperatures[:, row : row + len(block)] = block.T
+        row += len(block)
 
+    save_city_lookup(city_arrays, os.path.join(tmp_path, CITIES_FILE))
+    return commit_store(tmp_path, path, temperatures, filename)
 
-def build_reduced_city_lookup():
+
+@functools.lru_cache(maxsize=None)
+def load_dataset():
     """
-    Convert city_lookup types and assert data is valid
+    Dates, (cities x days) float32 temperatures and meta data of the dataset.
+    The binary store is built from the csv when it is missing or was built
+    from another csv, checked once per process so requests never stat the csv.
     """
-    city_lookup = build_city_lookup()
+    filename = all_filenames[0]
+    path = store_path(filename)
+    if not store_is_current(path, filename):
+        print("Building dataset store", path)
+        build_store(filename, path)
+        load_store.cache_clear()
 
-    # First 12 rows are information about the cities
-    city_lookup = build_city_lookup()
-    city_lookup = city_lookup[["city", "country", "lat", "lng", "population"]]
-    city_lookup.loc[:, "population"] = (
-        city_lookup.population.fillna(0).astype(float).astype(np.uint)
-    )
+    return load_store(path)
 
-    assert len(city_lookup) == len(city_lookup.drop_duplicates())
-    non_null = city_lookup[["city", "country", "lat", "lng"]]
-    assert len(non_null[non_null.isnull().T.any()]) == 0, non_null[
-        non_null.isnull().T.any()
-    ]
 
-    assert (
-        city_lookup.loc[
-            (city_lookup["lat"] < -90) | (city_lookup["lat"] > 90), "lat"
-        ].count()
-        == 0
-    )
-    assert (
-        city_lookup.loc[
-            (city_lookup["lng"] < -180) | (city_lookup["lng"] > 180), "lng"
-        ].count()
-        == 0
+_derived = {}
+
+
+def derived(name: str, compute):
+    """
+    Arrays computed from the current dataset by compute(dates, temperatures),
+    saved in its store as <name>.npz and kept for the life of the process, so
+    compute only runs once per dataset version
+    """
+    dates, temperatures, meta = load_dataset()
+    key = (name, meta["version"])
+    if key not in _derived:
+        _derived[key] = load_derived(
+            store_path(all_filenames[0]),
+            name,
+            meta["version"],
+            lambda: compute(dates, temperatures),
+        )
+    return _derived[key]
+
+
+def city_by_index(city_col: int):
+    """Read only the row of the store that contains the city we are interested in"""
+    dates, temperatures, _meta = load_dataset()
+    city_data = pd.Series(
+        temperatures[city_col].astype(np.float64).round(STORE_DECIMALS),
+        index=pd.DatetimeIndex(dates, name="datetime"),
+        name=str(city_col),
     )
 
-    return city_lookup
+    return city_data
+
+
+def date_rows(dates: np.ndarray, start=None, end=None):
+    """
+    Rows [first, last) of the sorted shared date column from start to end
+    inclusive, found by binary search so only that window needs reading
+    """
+    first = 0
+    last = len(dates)
+    if start is not None:
+        first = int(np.searchsorted(dates, np.datetime64(start, "D"), side="left"))
+    if end is not None:
+        last = int(np.searchsorted(dates, np.datetime64(end, "D"), side="right"))
+    return first, max(first, last)
+
+
+def cities_by_index(city_cols, start=None, end=None):
+    """
+    Dates and (cities x days) temperatures of several cities between start and
+    end. Only the pages of the store holding the window are read.
+    """
+    dates, temperatures, _meta = load_dataset()
+    first, last = date_rows(dates, start, end)
+    values = temperatures[list(city_cols), first:last].astype(np.float64)
+    return dates[first:last], values.round(STORE_DECIMALS)
 
 
 def data_summary(city_lookup, sample_city):
-    sample_city = city_by_index(0)
     return f"""#### Data
 This data contains daily temperatures for {len(city_lookup)} cities coving a population of at least {city_lookup["population"].sum():,} and {len(city_lookup["country"].unique())} countries. The first recorded day is {sample_city.index.min().strftime('%d %B, %Y')} and the last {sample_city.index.max().strftime('%d %B, %Y')}.
     
@@ -136,4 +237,4 @@ The website uses air temperature data made available by the Copernicus Climate S
 [Data license](https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode)
 
 The goal of this project is to make apparent any trends in the city temperature data. Each year is rendered on the charts in a different color
-"""
\ No newline at end of file
+"""
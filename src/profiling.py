@@ -0,0 +1,136 @@
+"""
+Opt-in profiler for single Dash callback requests.
+
+Off unless GLOBAL_TEMPS_PROFILE_TOKEN is set. A request to /_dash-update-component
+that carries the token in the X-Profile header or the ?token= (or ?profile=)
+query parameter, or the profile_token cookie holding an HMAC of the token, is
+run under cProfile and the stats are written as a pstats file to
+GLOBAL_TEMPS_PROFILE_DIR. cProfile only hooks the thread handling the request
+so other requests are not slowed down.
+
+Visit /_profile/enable?token=... in a browser to set the cookie, click the slow
+city, then list and download the captured files from /_profile/. Profiled
+requests build their figures instead of reading them from the figure store,
+see is_profiling.
+"""
+
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import re
+import time
+
+import flask
+
+PROFILE_TOKEN = os.environ.get("GLOBAL_TEMPS_PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get(
+    "GLOBAL_TEMPS_PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "profiles"),
+)
+PROFILE_PATHS = ("/_dash-update-component",)
+COOKIE_NAME = "profile_token"
+
+
+def _request_token():
+    return (
+        flask.request.headers.get("X-Profile")
+        or flask.request.args.get("token")
+        or flask.request.args.get("profile")
+        or ""
+    )
+
+
+def _cookie_value(token: str):
+    """What the cookie holds, so the token itself never sits in the browser"""
+    return hmac.new(
+        token.encode("utf-8"), COOKIE_NAME.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+
+def _matches(value: str, expected: str):
+    # compare_digest only takes ASCII str, the value comes from the request
+    return hmac.compare_digest(value.encode("utf-8"), expected.encode("utf-8"))
+
+
+def _is_admin(token: str):
+    if token == "":
+        return False
+    cookie = flask.request.cookies.get(COOKIE_NAME, "")
+    return _matches(_request_token(), token) or _matches(cookie, _cookie_value(token))
+
+
+def is_profiling():
+    """True while handling a profiled request"""
+    return flask.has_request_context() and "profiler" in flask.g
+
+
+def _profile_name():
+    """Name the file after the callback output and its input values (the city id)"""
+    label = "request"
+    body = flask.request.get_json(silent=True) or {}
+    if "output" in body:
+        values = [str(i.get("value")) for i in body.get("inputs", [])]
+        label = "_".join([body["output"]] + values)
+    label = re.sub(r"[^A-Za-z0-9_.-]+", "-", label)[:100]
+    return f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{label}.prof"
+
+
+def register_profiler(
+    server: flask.Flask, token: str = PROFILE_TOKEN, profile_dir: str = PROFILE_DIR
+):
+    """Attach the profiling hooks and the /_profile routes to the flask server"""
+    if token == "":
+        return
+
+    os.makedirs(profile_dir, exist_ok=True)
+
+    @server.before_request
+    def _start_profile():
+        if flask.request.path in PROFILE_PATHS and _is_admin(token):
+            flask.g.profiler = cProfile.Profile()
+            flask.g.profiler.enable()
+
+    @server.after_request
+    def _stop_profile(response):
+        profiler = flask.g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            name = _profile_name()
+            profiler.dump_stats(os.path.join(profile_dir, name))
+            response.headers["X-Profile-File"] = "/_profile/" + name
+        return response
+
+    @server.route("/_profile/enable")
+    def _enable_profile():
+        if not _is_admin(token):
+            flask.abort(403)
+        response = flask.make_response("Profiling enabled for this browser")
+        response.set_cookie(
+            COOKIE_NAME,
+            _cookie_value(token),
+            httponly=True,
+            secure=True,
+            samesite="Strict",
+        )
+        return response
+
+    @server.route("/_profile/disable")
+    def _disable_profile():
+        response = flask.make_response("Profiling disabled for this browser")
+        response.delete_cookie(COOKIE_NAME)
+        return response
+
+    @server.route("/_profile/")
+    def _list_profiles():
+        if not _is_admin(token):
+            flask.abort(403)
+        names = sorted(f for f in os.listdir(profile_dir) if f.endswith(".prof"))
+        return flask.Response(json.dumps(names), mimetype="application/json")
+
+    @server.route("/_profile/<name>")
+    def _download_profile(name):
+        if not _is_admin(token):
+            flask.abort(403)
+        return flask.send_from_directory(profile_dir, name, as_attachment=True)
@@ -6,7 +6,6 @@ import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
-from matplotlib import cm
 import plotly.express as px
 import datetime
 import urllib
@@ -27,6 +26,8 @@ import pandas as pd
 import dash_daq as daq
 from joblib import Memory
 
+from palette import colors
+
 memory = Memory("cache", verbose=0)
 
 df = preprocess(load_data)
@@ -138,8 +139,9 @@ http://academic.udayton.edu/kissock/http/Weather/default.htm
 
 """
 
-viridis = cm.get_cmap("viridis", 12)
-year_colors = list(reversed(viridis(np.linspace(0, 1, 2021 - int(df.Date.min().year)))))
+year_colors = colors(
+    "viridis", np.linspace(1, 0, 2021 - int(df.Date.min().year)), levels=12
+)
 
 
 def get_symbol(is_fahrenheit):
@@ -170,8 +172,7 @@ def update_month_each_year_graph(city_country, is_fahrenheit):
 
     for y in yearly_data:
         y[1].index = y[1].index.map(lambda dt: dt.replace(year=2020))
-        chosen_color = year_colors[(2021 - y[0]) - 1]
-        rgb_color = f"rgb({int(chosen_color[1] * 256)},{int(chosen_color[2] * 256)},{int(chosen_color[3] * 256)})"
+        rgb_color = year_colors[(2021 - y[0]) - 1]
 
         series = y[1]
 
@@ -231,8 +232,7 @@ def get_yearly_avg_fig(city_country, is_fahrenheit):
         .mean()
     )
     for y in yearly_data:
-        chosen_color = year_colors[(2021 - y[0]) - 1]
-        rgb_color = f"rgb({int(chosen_color[1] * 256)},{int(chosen_color[2] * 256)},{int(chosen_color[3] * 256)})"
+        rgb_color = year_colors[(2021 - y[0]) - 1]
 
         single_year = yearly_mean[
             (yearly_mean.index.year == int(y[0]))
@@ -280,8 +280,7 @@ def build_city_all_with_mean(city_country, is_fahrenheit):
     fig = go.Figure()
 
     for y in yearly_data:
-        chosen_color = year_colors[(2021 - y[0]) - 1]
-        rgb_color = f"rgb({int(chosen_color[1] * 256)},{int(chosen_color[2] * 256)},{int(chosen_color[3] * 256)})"
+        rgb_color = year_colors[(2021 - y[0]) - 1]
 
         fig.add_trace(
             go.Scatter(
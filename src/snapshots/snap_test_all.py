@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# snapshottest: v1 - https://goo.gl/zC4yUc
+from __future__ import unicode_literals
+
+from snapshottest import Snapshot
+
+snapshots = Snapshot()
+
+snapshots["TestSnapshot::test_snapshot_match data_summary"] = """#### Data
+This data contains daily temperatures for 10 cities coving a population of at least 181,262,468 and 8 countries. The first recorded day is 01 January, 2017 and the last 15 October, 2020.
+    
+The website uses air temperature data made available by the Copernicus Climate Service.
+
+* Raw temperature data from [https://cds.climate.copernicus.eu](https://cds.climate.copernicus.eu)
+* City data from [https://simplemaps.com/](https://simplemaps.com/data/world-cities)
+* Time-series extracted via [https://oikolab.com](https://oikolab.com)
+[Data license](https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode)
+
+The goal of this project is to make apparent any trends in the city temperature data. Each year is rendered on the charts in a different color
+"""
+
+snapshots[
+    "TestSnapshot::test_snapshot_match los_angeles_monthly"
+] = """Year,1,2,3,4,5,6,7,8,9,10,11,12
+2017,8.8,9.76,11.32,14.92,17.57,20.42,22.26,20.52,19.15,14.73,12.36,9.07
+2018,8.32,8.75,12.11,15.09,18.4,20.63,21.64,21.14,19.04,15.47,11.7,9.85
+2019,8.01,9.15,10.95,15.22,18.34,20.49,21.42,20.5,19.21,15.31,12.39,8.67
+2020,9.69,9.33,11.4,14.71,18.27,20.77,21.64,21.21,18.54,17.03,,
+"""
@@ -0,0 +1,120 @@
+"""
+Streaming reader for the wide csv layout.
+
+The first 12 rows after the header describe the cities, then each row is one
+day with a column per city. The reader yields typed blocks of days so whole
+dataset passes run in bounded memory instead of loading the 1000 column csv
+with object inference in one go.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Number of rows at the top of the csv that describe the cities
+CITY_INFO_ROWS = 12
+
+
+def _read_header(filename: str):
+    with open(filename, "r", encoding="utf-8") as f:
+        return f.readline().rstrip("\r\n").split(",")[1:]
+
+
+def count_cities(filename: str):
+    return len(_read_header(filename))
+
+
+def iter_row_blocks(filename: str, block_rows: int = 1024, usecols=None):
+    """
+    Yield (dates, values) for each block of up to block_rows days. dates is
+    datetime64[D] and values a float32 (days x cities) array, NaN where a day
+    is missing. usecols picks city columns by index, default all cities.
+    """
+    if usecols is None:
+        usecols = range(count_cities(filename))
+    columns = [0] + [c + 1 for c in usecols]
+
+    reader = pd.read_csv(
+        filename,
+        header=None,
+        skiprows=CITY_INFO_ROWS + 1,
+        usecols=columns,
+        index_col=0,
+        dtype={c: np.float32 for c in columns[1:]},
+        chunksize=block_rows,
+    )
+    for chunk in reader:
+        dates = pd.to_datetime(chunk.index).to_numpy().astype("datetime64[D]")
+        yield dates, chunk[columns[1:]].to_numpy(dtype=np.float32)
+
+
+def read_dates(filename: str):
+    """The date column on its own"""
+    dates = pd.read_csv(
+        filename,
+        header=None,
+        skiprows=CITY_INFO_ROWS + 1,
+        usecols=[0],
+    ).iloc[:, 0]
+    return pd.to_datetime(dates).to_numpy().astype("datetime64[D]")
+
+
+class RunningStats:
+    """
+    Online per-city count, missing days, mean, standard deviation, min and max.
+    Blocks are merged with Chan's parallel variance update so the result does
+    not depend on the block size.
+    """
+
+    def __init__(self, n_cities: int):
+        self.count = np.zeros(n_cities, dtype=np.int64)
+        self.missing = np.zeros(n_cities, dtype=np.int64)
+        self.mean = np.zeros(n_cities, dtype=np.float64)
+        self.m2 = np.zeros(n_cities, dtype=np.float64)
+        self.min = np.full(n_cities, np.nan, dtype=np.float64)
+        self.max = np.full(n_cities, np.nan, dtype=np.float64)
+
+    def update(self, block: np.ndarray):
+        """Add a (days x cities) block"""
+        valid = ~np.isnan(block)
+        n = valid.sum(axis=0)
+        self.missing += len(block) - n
+
+        block_sum = np.where(valid, block, 0).sum(axis=0, dtype=np.float64)
+        block_mean = np.divide(block_sum, n, out=np.zeros_like(block_sum), where=n > 0)
+        block_m2 = (np.where(valid, block - block_mean, 0) ** 2).sum(
+            axis=0, dtype=np.float64
+        )
+
+        total = self.count + n
+        delta = block_mean - self.mean
+        weight = np.divide(n, total, out=np.zeros(len(n)), where=total > 0)
+        self.mean += delta * weight
+        self.m2 += block_m2 + delta**2 * self.count * weight
+        self.count = total
+
+        self.min = np.fmin(self.min, np.fmin.reduce(block, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(block, axis=0))
+
+    @property
+    def std(self):
+        return np.sqrt(
+            np.divide(
+                self.m2,
+                self.count,
+                out=np.full_like(self.m2, np.nan),
+                where=self.count > 0,
+            )
+        )
+
+    def to_frame(self, index=None):
+        return pd.DataFrame(
+            {
+                "count": self.count,
+                "missing": self.missing,
+                "mean": np.where(self.count > 0, self.mean, np.nan),
+                "std": self.std,
+                "min": self.min,
+                "max": self.max,
+            },
+            index=index,
+        )
@@ -1,74 +1,719 @@
+import io
+import json
+import os
+import shutil
+import tempfile
 import unittest
+
+# Fixture dataset settings when run as a script, pytest imports it first
+import conftest  # noqa: F401
+
+import flask
+import plotly.graph_objs as go
+import pyarrow as pa
+import pyarrow.parquet as pq
 import snapshottest
 import numpy as np
+import pandas as pd
 
 from process_data import (
-    preprocess,
-    load_data,
-    column_dtypes,
-    build_city_df,
-    calc_monthly,
-    load_city_lat_long,
+    all_filenames,
+    build_reduced_city_lookup,
+    build_store,
+    city_by_index,
+    load_dataset,
 )
+from process_city_data import calc_monthly
+from stream_data import RunningStats, iter_row_blocks
+from dataset_store import load_store, store_is_current, store_path
+from data_quality import gap_years, outlier_mask
+from monthly_stats import month_extremes, monthly_table
+from aggregates import series_by_key
+from profiling import is_profiling, register_profiler
+from figure_store import FigureStore
+from geo_data import geocode_keys
+from palette import TABLES, colors, year_colors
+from ingest import ingest, series_span, write_wide_csv
+from print_data_stats import city_stats
+from process_data import parse_city_lookup
+from city_clusters import (
+    MAX_CLUSTER_ZOOM,
+    build_cluster_hierarchy,
+    clusters_in_bounds,
+    view_bounds,
+)
+import app
+
+LOS_ANGELES = 8
+NEW_YORK = 1
+MUMBAI = 3
+DELHI = 5
+
+
+def temporary_dir(test: unittest.TestCase, prefix: str):
+    """Directory removed when the test finishes"""
+    path = tempfile.mkdtemp(prefix=prefix)
+    test.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    return path
 
 
 class TestStringMethods(unittest.TestCase):
-    def test_load_data(self):
-        df = preprocess(load_data)
+    def test_build_reduced_city_lookup(self):
+        city_lookup = build_reduced_city_lookup()
+
+        self.assertEqual(len(city_lookup), 10)
+        self.assertEqual(city_lookup["city"].iat[LOS_ANGELES], "Los Angeles")
+        self.assertEqual(city_lookup["lat"].dtype, np.float32)
+        self.assertEqual(city_lookup["population"].dtype, np.uint32)
+        # London has no population in the csv
+        self.assertEqual(city_lookup["population"].iat[9], 0)
+
+    def test_city_by_index(self):
+        city_df = city_by_index(LOS_ANGELES)
+        raw = pd.read_csv(
+            all_filenames[0], skiprows=range(1, 13), index_col=0, parse_dates=True
+        )
+
+        self.assertEqual(city_df.index.name, "datetime")
+        self.assertEqual(len(city_df), len(raw))
+        np.testing.assert_allclose(city_df.to_numpy(), raw[str(LOS_ANGELES)])
+        self.assertEqual(city_by_index(NEW_YORK).isnull().sum(), 30)
+
+    def test_store_is_current(self):
+        filename = os.path.join(temporary_dir(self, "store_"), "d.csv")
+        shutil.copy(all_filenames[0], filename)
+        path = store_path(filename)
+        self.assertFalse(store_is_current(path, filename))
+
+        meta = build_store(filename, path)
+        self.assertTrue(store_is_current(path, filename))
+        self.assertEqual(meta["version"], load_dataset()[2]["version"])
+        # Building again replaces the committed store in place
+        build_store(filename, path)
+        _dates, temperatures, _meta = load_store(path)
+        self.assertEqual(temperatures.shape, load_dataset()[1].shape)
+
+        with open(filename, "a") as f:
+            f.write("2020-10-16" + ",1.0" * len(temperatures) + "\n")
+        self.assertFalse(store_is_current(path, filename))
+
+    def test_running_stats(self):
+        raw = pd.read_csv(all_filenames[0], skiprows=range(1, 13), index_col=0)
+        values = raw.to_numpy(dtype=np.float64)
+
+        for block_rows in (7, 100, 5000):
+            stats = RunningStats(values.shape[1])
+            row = 0
+            for dates, block in iter_row_blocks(all_filenames[0], block_rows):
+                self.assertLessEqual(len(block), block_rows)
+                self.assertEqual(dates.dtype, np.dtype("datetime64[D]"))
+                stats.update(block)
+                row += len(block)
+            self.assertEqual(row, len(values))
+
+            np.testing.assert_array_equal(stats.count, (~np.isnan(values)).sum(axis=0))
+            np.testing.assert_array_equal(stats.missing, np.isnan(values).sum(axis=0))
+            np.testing.assert_allclose(
+                stats.mean, np.nanmean(values, axis=0), rtol=1e-6
+            )
+            np.testing.assert_allclose(stats.std, np.nanstd(values, axis=0), rtol=1e-5)
+            np.testing.assert_allclose(stats.min, np.nanmin(values, axis=0), rtol=1e-6)
+            np.testing.assert_allclose(stats.max, np.nanmax(values, axis=0), rtol=1e-6)
 
-        # check temperature values
-        self.assertEqual(df.loc[df.AvgTemperature < -100, "AvgTemperature"].count(), 0)
-        self.assertEqual(df.loc[df.AvgTemperature > 200, "AvgTemperature"].count(), 0)
+        # usecols reads the chosen cities only
+        _dates, block = next(iter_row_blocks(all_filenames[0], 10, usecols=[MUMBAI, 8]))
+        np.testing.assert_allclose(block, values[:10, [MUMBAI, 8]], rtol=1e-6)
 
-        non_null_cols = df.drop(columns=["State", "AvgTemperature"])
-        nan_rows = non_null_cols[non_null_cols.isnull().T.any()]
-        # check for nan, nulls, empty str
+    def test_city_stats_of_another_csv(self):
+        filename = os.path.join(temporary_dir(self, "stats_"), "d.csv")
+        cities = pd.DataFrame(
+            {
+                "city": ["Oran", "Lima"],
+                "lat": ["35.7", "-12.06"],
+                "lng": ["-0.63", "-77.04"],
+                "country": ["Algeria", "Peru"],
+            }
+        )
+        dates = np.arange(np.datetime64("2020-01-01"), np.datetime64("2020-01-04"))
+        temperatures = np.array([[10, 12, np.nan], [20, 21, 22]], dtype=np.float32)
+        write_wide_csv(filename, cities, dates, temperatures)
+
+        stats, first_date, last_date = city_stats(filename, block_rows=2)
+        self.assertEqual(list(stats.index), ["Oran, Algeria", "Lima, Peru"])
+        self.assertEqual(list(stats["country"]), ["Algeria", "Peru"])
+        np.testing.assert_allclose(stats["mean"], [11, 21])
+        self.assertEqual(list(stats["missing"]), [1, 0])
         self.assertEqual(
-            len(nan_rows),
-            0,
-            nan_rows,
+            (first_date, last_date),
+            (pd.Timestamp("2020-01-01"), pd.Timestamp("2020-01-03")),
+        )
+
+    def test_calc_monthly(self):
+        monthly = calc_monthly(city_by_index(LOS_ANGELES))
+
+        self.assertEqual(monthly.shape, (4, 12))
+        # The fixture ends in October 2020
+        self.assertTrue(monthly.loc[2020, [11, 12]].isnull().all())
+        np.testing.assert_allclose(
+            monthly.to_numpy(), monthly_table(LOS_ANGELES).to_numpy(), atol=1e-3
         )
-        city_country = df["CityCountry"]
-        self.assertFalse(city_country.isnull().any().any())
 
+    def test_month_extremes(self):
+        city_lookup = build_reduced_city_lookup()
+        frames = []
+        for city_id in range(len(city_lookup)):
+            monthly = city_by_index(city_id).resample("MS").mean()
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "country": city_lookup["country"].iat[city_id],
+                        "city_id": city_id,
+                        "city": city_lookup["city"].iat[city_id],
+                        "year": monthly.index.year,
+                        "month": monthly.index.month,
+                        "value": monthly.to_numpy(),
+                    }
+                )
+            )
+        months = pd.concat(frames, ignore_index=True).dropna()
+
+        for month, stat, by, year in [
+            (7, "max", "country", None),
+            (1, "min", "country", None),
+            (3, "min", "country", 2018),
+            (12, "max", "dataset", None),
+            (6, "min", "dataset", 2019),
+        ]:
+            selected = months[months["month"] == month]
+            if year is not None:
+                selected = selected[selected["year"] == year]
+            groups = selected["country"] if by == "country" else np.zeros(len(selected))
+            best = selected.groupby(groups)["value"].agg(f"idx{stat}")
+            expected = selected.loc[best].sort_values("country")
+
+            extremes = month_extremes(month, stat, by, year).sort_values("country")
+            self.assertEqual(len(extremes), len(expected))
+            for column in ("country", "city_id", "city", "year"):
+                self.assertEqual(
+                    list(extremes[column]), list(expected[column]), (month, stat, by)
+                )
+            np.testing.assert_allclose(extremes["value"], expected["value"], atol=1e-3)
+
+        with self.assertRaises(LookupError):
+            month_extremes(7, year=1990)
+
+    def test_data_quality(self):
+        self.assertEqual(list(gap_years(NEW_YORK)), [2018])
+        dates, _temperatures, _meta = load_dataset()
         self.assertEqual(
-            len(np.where(city_country == "")[0]),
-            0,
-            np.where(city_country == "")[0],
+            list(dates[outlier_mask(DELHI)]), [np.datetime64("2019-06-01")]
         )
 
-    def test_build_city_df(self):
-        df = preprocess(load_data)
+    def test_country_series(self):
+        city_lookup = build_reduced_city_lookup()
+        country_code = city_lookup["country"].cat.codes.iat[LOS_ANGELES]
+        population = city_lookup["population"].to_numpy(dtype=float)
+        los_angeles, new_york = city_by_index(LOS_ANGELES), city_by_index(NEW_YORK)
 
-        # check columns
-        self.assertRaises(LookupError, build_city_df, df, "test", False)
-        build_city_df(df, "Abilene, Texas, US", False)
+        expected = (
+            los_angeles * population[LOS_ANGELES] + new_york * population[NEW_YORK]
+        ) / (population[LOS_ANGELES] + population[NEW_YORK])
+        # New York is missing in March 2018, the mean is Los Angeles alone
+        expected = expected.fillna(los_angeles)
+        np.testing.assert_allclose(
+            series_by_key(f"country_id_{country_code}"), expected, atol=1e-3
+        )
 
-    def test_calc_monthly(self):
-        df = preprocess(load_data)
+    def test_figures(self):
+        city_country = f"city_id_{NEW_YORK}"
+        for is_fahrenheit in (False, True):
+            app.build_city_all_with_mean.func(city_country, is_fahrenheit)
+            app.build_climatology_fig.func(city_country, is_fahrenheit)
+            app.get_yearly_avg_fig.func(city_country, is_fahrenheit)
+            app.build_year_heatmap_fig.func(city_country, is_fahrenheit)
+
+        fig = app.update_month_each_year_graph.func(city_country, False)
+        self.assertEqual(
+            [trace.name for trace in fig.data], ["2017", "2018 (gaps)", "2019", "2020"]
+        )
+
+    def test_figures_of_aggregates(self):
+        for key in ("global", "country_id_0"):
+            fig = app.update_month_each_year_graph.func(key, False)
+            # Averaging over cities fills New York's gap, no year is dotted
+            self.assertEqual(
+                [trace.name for trace in fig.data], ["2017", "2018", "2019", "2020"]
+            )
+            self.assertEqual(fig.layout.title.text, "⛅ Overlay of years 2017 to 2020")
+            # Years are drawn on the 2020 calendar, so 2020 is binned as is
+            last_year = series_by_key(key)["2020"]
+            np.testing.assert_allclose(
+                fig.data[-1].y, last_year.groupby(pd.Grouper(freq="15D")).mean()
+            )
+
+
+class TestCityApi(unittest.TestCase):
+    def setUp(self):
+        self.client = app.server.test_client()
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_window(self):
+        window = self.get_json(
+            f"/api/city/{LOS_ANGELES}?start=2018-02-27&end=2018-03-02"
+        )
+        self.assertEqual(
+            window["dates"], ["2018-02-27", "2018-02-28", "2018-03-01", "2018-03-02"]
+        )
+        np.testing.assert_allclose(
+            window["cities"][0]["values"],
+            city_by_index(LOS_ANGELES)["2018-02-27":"2018-03-02"],
+        )
+
+        # Start after end is an empty window, not an error
+        window = self.get_json(
+            f"/api/city/{LOS_ANGELES}?start=2019-01-02&end=2019-01-01"
+        )
+        self.assertEqual(window["dates"], [])
+        self.assertEqual(window["cities"][0]["values"], [])
+
+        # Past the data the window is clipped to the record
+        window = self.get_json(
+            f"/api/city/{LOS_ANGELES}?start=2020-10-10&end=2030-01-01"
+        )
+        self.assertEqual(window["dates"][0], "2020-10-10")
+        self.assertEqual(window["dates"][-1], "2020-10-15")
+        self.assertEqual(
+            self.get_json(f"/api/city/{LOS_ANGELES}?start=2030-01-01")["dates"], []
+        )
+
+    def test_errors(self):
+        for url in (
+            "/api/city/abc",
+            f"/api/city/{LOS_ANGELES}?agg=weekly",
+            f"/api/city/{LOS_ANGELES}?format=xml",
+            f"/api/city/{LOS_ANGELES}?start=not-a-date",
+            "/api/city/" + ",".join(["0"] * 101),
+        ):
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+        for url in ("/api/city/10", "/api/city/-1", f"/api/city/{LOS_ANGELES},10"):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+    def test_monthly_skips_missing_days(self):
+        window = self.get_json(f"/api/city/{NEW_YORK},{MUMBAI}?agg=monthly")
+        for city, city_id in zip(window["cities"], (NEW_YORK, MUMBAI)):
+            expected = city_by_index(city_id).resample("MS").mean()
+            self.assertEqual(window["dates"], list(expected.index.strftime("%Y-%m")))
+            np.testing.assert_allclose(city["values"], expected, atol=1e-4)
+        # New York has one day left in March 2018, the mean is that day
+        march = window["dates"].index("2018-03")
+        self.assertAlmostEqual(
+            window["cities"][0]["values"][march],
+            city_by_index(NEW_YORK)["2018-03-31"],
+            places=4,
+        )
+
+    def test_csv_and_arrow(self):
+        city_ids = [LOS_ANGELES, NEW_YORK]
+        expected = pd.DataFrame({str(i): city_by_index(i)["2018"] for i in city_ids})
+        url = "/api/city/8,1?start=2018-01-01&end=2018-12-31&format="
+
+        frame = pd.read_csv(io.BytesIO(self.client.get(url + "csv").data), index_col=0)
+        self.assertEqual(list(frame.columns), ["8", "1"])
+        self.assertEqual(list(frame.index), list(expected.index.strftime("%Y-%m-%d")))
+        np.testing.assert_allclose(frame, expected)
+
+        response = self.client.get(url + "arrow")
+        self.assertEqual(response.mimetype, "application/vnd.apache.arrow.stream")
+        table = pa.ipc.open_stream(response.data).read_all()
+        self.assertEqual(table.schema.field("date").type, pa.date32())
+        frame = table.to_pandas().set_index("date")
+        self.assertEqual(list(pd.DatetimeIndex(frame.index)), list(expected.index))
+        np.testing.assert_allclose(frame, expected, rtol=1e-6)
+
+
+class TestExportApi(unittest.TestCase):
+    def setUp(self):
+        self.client = app.server.test_client()
+
+    def export(self, output_format, query):
+        response = self.client.get(f"/api/export/temperatures.{output_format}?{query}")
+        self.assertEqual(response.status_code, 200)
+        if output_format == "parquet":
+            table = pq.read_table(io.BytesIO(response.data))
+        else:
+            table = pa.ipc.open_stream(response.data).read_all()
+        self.assertEqual(table.schema.field("date").type, pa.date32())
+        frame = table.to_pandas()
+        return frame.set_index(pd.DatetimeIndex(frame.pop("date")))
+
+    def test_daily(self):
+        for output_format in ("arrow", "parquet"):
+            frame = self.export(
+                output_format, "cities=8,1&start=2018-02-27&end=2018-03-02"
+            )
+            expected = pd.DataFrame(
+                {str(i): city_by_index(i)["2018-02-27":"2018-03-02"] for i in (8, 1)}
+            )
+            self.assertEqual(list(frame.columns), ["8", "1"])
+            self.assertEqual(list(frame.index), list(expected.index))
+            np.testing.assert_allclose(frame, expected, rtol=1e-6)
+
+    def test_monthly_and_yearly(self):
+        for output_format in ("arrow", "parquet"):
+            # start and end select the whole periods they fall in
+            frame = self.export(
+                output_format, "cities=1,3&agg=monthly&start=2018-02-15&end=2018-04-01"
+            )
+            expected = pd.DataFrame(
+                {
+                    str(i): city_by_index(i).resample("MS").mean()["2018-02":"2018-04"]
+                    for i in (1, 3)
+                }
+            )
+            self.assertEqual(list(frame.index), list(expected.index))
+            np.testing.assert_allclose(frame, expected, atol=1e-4)
+
+            frame = self.export(output_format, "cities=all&agg=yearly&start=2018-06-30")
+            expected = pd.DataFrame(
+                {
+                    str(i): city_by_index(i).resample("AS").mean()["2018":]
+                    for i in range(10)
+                }
+            )
+            self.assertEqual(list(frame.index), list(expected.index))
+            np.testing.assert_allclose(frame, expected, atol=1e-4)
+
+        # The whole record, the fixture starts in January 2017 and ends in October 2020
+        frame = self.export("arrow", "cities=8&agg=monthly")
+        self.assertEqual(frame.index[0], pd.Timestamp("2017-01-01"))
+        self.assertEqual(frame.index[-1], pd.Timestamp("2020-10-01"))
+        self.assertFalse(frame.isnull().any().any())
+
+
+class TestPalette(unittest.TestCase):
+    def test_year_colors(self):
+        self.assertEqual(
+            year_colors(2017, 2020),
+            {
+                2017: "rgb(81,18,124)",
+                2018: "rgb(126,36,130)",
+                2019: "rgb(175,52,123)",
+                2020: "rgb(222,73,104)",
+            },
+        )
+        years = year_colors(1980, 2020)
+        self.assertEqual(list(years), list(range(1980, 2021)))
+        self.assertEqual(
+            [years[1980], years[2000], years[2020]],
+            ["rgb(81,18,124)", "rgb(150,44,128)", "rgb(222,73,104)"],
+        )
+        self.assertEqual(year_colors(2017, 2017), {2017: "rgb(81,18,124)"})
+
+    def test_matplotlib_parity(self):
+        try:
+            from matplotlib import cm
+        except ImportError:
+            self.skipTest("matplotlib is not installed")
+
+        def rgb(rgba):
+            return [
+                "rgb(%d,%d,%d)" % tuple(int(c * 256) for c in color[:3])
+                for color in rgba
+            ]
+
+        positions = np.r_[np.linspace(0, 1, 1001), 0.25, 0.6]
+        for name in TABLES:
+            self.assertEqual(colors(name, positions), rgb(cm.get_cmap(name)(positions)))
+            for levels in (2, 10, 41):
+                self.assertEqual(
+                    colors(name, positions, levels),
+                    rgb(cm.get_cmap(name, levels)(positions)),
+                )
+
+        years = np.linspace(0.25, 0.6, 41)
+        self.assertEqual(
+            list(year_colors(1980, 2020).values()), rgb(cm.get_cmap("magma")(years))
+        )
+
+
+class TestCityClusters(unittest.TestCase):
+    def setUp(self):
+        # Two cities each side of the antimeridian and one far from it
+        self.cities = pd.DataFrame(
+            {
+                "city": ["Suva", "Apia", "Auckland", "Honolulu", "London"],
+                "lat": np.array([-18.14, -13.83, -36.85, 21.31, 51.51], np.float32),
+                "lng": np.array([178.44, -171.77, 174.76, -157.86, -0.13], np.float32),
+                "population": np.array([93970, 37708, 1346091, 345510, 8961989]),
+            }
+        )
+        self.hierarchy = build_cluster_hierarchy(self.cities)
+        self.single = MAX_CLUSTER_ZOOM + 1
+
+    def cities_in(self, bounds):
+        level = self.hierarchy[self.single]
+        ids = level["city_id"][clusters_in_bounds(self.hierarchy, self.single, bounds)]
+        return sorted(self.cities["city"].iloc[ids])
 
-        # check columns
-        calc_monthly(build_city_df(df, "Abilene, Texas, US", False))
+    def test_bounds(self):
+        self.assertEqual(len(self.cities_in(None)), 5)
+        self.assertEqual(self.cities_in([[40, -10], [60, 10]]), ["London"])
+        self.assertEqual(self.cities_in([[-40, 170], [0, 180]]), ["Auckland", "Suva"])
+        # Wider than the world keeps every longitude
+        self.assertEqual(len(self.cities_in([[-90, -400], [90, 400]])), 5)
 
-    def test_load_city_lat_long(self):
-        load_city_lat_long()
+    def test_antimeridian(self):
+        expected = ["Apia", "Auckland", "Suva"]
+        # Panned east past 180 and west past -180, and as leaflet wraps them
+        self.assertEqual(self.cities_in([[-40, 170], [0, 190]]), expected)
+        self.assertEqual(self.cities_in([[-40, -190], [0, -170]]), expected)
+        self.assertEqual(self.cities_in([[-40, 170], [0, -170]]), expected)
 
-    def test_find_lat_long(self):
-        city_lat_long = load_city_lat_long()
+    def test_levels(self):
+        # Everything is one cluster at zoom 0, a city per point at the top
+        self.assertEqual(self.hierarchy[0]["count"].sum(), 5)
+        self.assertLess(len(self.hierarchy[0]["count"]), 5)
+        np.testing.assert_array_equal(self.hierarchy[self.single]["count"], 1)
 
-        df = preprocess(load_data)
+    def test_view_bounds(self):
+        (south, west), (north, east) = view_bounds((-18.14, 178.44), 5)
+        self.assertLess(south, -18.14)
+        self.assertGreater(north, -18.14)
+        self.assertLess(east - west, 360)
+        self.assertEqual(
+            self.cities_in(view_bounds((-18.14, 178.44), 6)), ["Apia", "Suva"]
+        )
+        # Zoomed out the view covers the whole world
+        self.assertEqual(len(self.cities_in(view_bounds((0, 0), 0))), 5)
 
-        for city_key in list(df.CityCountry.unique()):
-            if city_key in city_lat_long:
-                print(city_lat_long[city_key])
+
+class TestIngest(unittest.TestCase):
+    def test_geocode_keys(self):
+        self.assertEqual(
+            geocode_keys("Oran", "Oran", "Algeria"),
+            ["Oran, Oran, Algeria", "Oran, Algeria"],
+        )
+        for admin_name in ("", " ", np.nan):
+            self.assertEqual(
+                geocode_keys("Algiers", admin_name, "Algeria"), ["Algiers, Algeria"]
+            )
+
+    def test_ingest(self):
+        tmp_dir = temporary_dir(self, "ingest_")
+        cities_filename = os.path.join(tmp_dir, "cities.csv")
+        with open(cities_filename, "w", encoding="utf-8") as f:
+            f.write(
+                "city,city_ascii,lat,lng,country,iso2,iso3,admin_name,capital,population,id\n"
+                "Oran,Oran,35.6969,-0.6331,Algeria,DZ,DZA,Oran,admin,852000,1\n"
+                "Algiers,Algiers,,,Algeria,DZ,DZA,,primary,3415811,2\n"
+                "Lima,Lima,-12.06,-77.0375,Peru,PE,PER,Lima,primary,9848000,3\n"
+                "Quito,Quito,-0.22,-78.5125,Ecuador,EC,ECU,Pichincha,primary,2011388,4\n"
+            )
+        geocode_cache_filename = os.path.join(tmp_dir, "geocode.json")
+        with open(geocode_cache_filename, "w", encoding="utf-8") as f:
+            json.dump({"Algiers, Algeria": {"latt": "36.7764", "longt": "3.0586"}}, f)
+
+        series_dir = os.path.join(tmp_dir, "series")
+        os.makedirs(series_dir)
+        # Hourly readings for Oran, daily for the others, no file for Quito
+        hours = pd.date_range("2020-01-01", "2020-01-03 23:00", freq="H")
+        pd.DataFrame({"time": hours, "t2m": np.arange(len(hours)) % 24}).to_csv(
+            os.path.join(series_dir, "1.csv"), index=False
+        )
+        pd.DataFrame(
+            {"time": pd.date_range("2020-01-02", periods=3), "t2m": [10, 11, 99]}
+        ).to_csv(os.path.join(series_dir, "2.csv"), index=False)
+        # Lima's rows are not sorted and the file ends with blank lines
+        with open(os.path.join(series_dir, "3.csv"), "w") as f:
+            f.write("time,t2m\n2020-01-02,21\n2020-01-01,20\n\n\n")
+
+        output_filename = os.path.join(tmp_dir, "d.csv")
+        meta = ingest(
+            cities_filename,
+            series_dir,
+            output_filename,
+            geocode_cache_filename=geocode_cache_filename,
+            workers=1,
+            chunk_size=1,
+        )
+        self.assertEqual(meta["n_cities"], 3)
+        self.assertEqual(
+            (meta["first_date"], meta["last_date"]), ("2020-01-01", "2020-01-04")
+        )
+        self.assertTrue(store_is_current(store_path(output_filename), output_filename))
+
+        lookup = parse_city_lookup(output_filename)
+        self.assertEqual(
+            list(lookup["city_categories"][lookup["city_codes"]]),
+            ["Oran", "Algiers", "Lima"],
+        )
+        np.testing.assert_allclose(lookup["lat"][1], 36.7764)
+
+        _dates, temperatures, _meta = load_store(store_path(output_filename))
+        np.testing.assert_allclose(
+            temperatures,
+            [
+                [11.5, 11.5, 11.5, np.nan],
+                # 99°C is out of range and dropped
+                [np.nan, 10, 11, np.nan],
+                [20, 21, np.nan, np.nan],
+            ],
+        )
+
+    def test_series_span_errors(self):
+        tmp_dir = temporary_dir(self, "ingest_")
+        for name, content in [("empty.csv", ""), ("header.csv", "time,t2m\n\n")]:
+            filename = os.path.join(tmp_dir, name)
+            with open(filename, "w") as f:
+                f.write(content)
+            with self.assertRaisesRegex(ValueError, name):
+                series_span(filename)
+
+
+class TestFigureStore(unittest.TestCase):
+    def setUp(self):
+        self.path = temporary_dir(self, "figure_store_")
+        self.calls = []
+
+    def chart(self, city_country, is_fahrenheit):
+        self.calls.append((city_country, is_fahrenheit))
+        return go.Figure(go.Scatter(x=[1, 2], y=[3.5, 4.5], name=city_country))
+
+    def test_put_and_hit(self):
+        store = FigureStore(self.path, "v1")
+        cached = store.cache(self.chart)
+
+        built = cached("city_id_1", False)
+        self.assertEqual(built["data"][0]["name"], "city_id_1")
+        self.assertEqual(built["data"][0]["y"], [3.5, 4.5])
+        # Written under a temporary name then renamed, nothing else is left
+        files = [f for _root, _dirs, names in os.walk(self.path) for f in names]
+        self.assertEqual(files, ["city_id_1_C.json"])
+
+        self.assertEqual(cached("city_id_1", False), built)
+        self.assertEqual(self.calls, [("city_id_1", False)])
+        cached("city_id_1", True)
+        self.assertEqual(len(self.calls), 2)
+        with self.assertRaises(LookupError):
+            cached("../city_id_1", False)
+
+    def test_eviction_order(self):
+        old = FigureStore(self.path, "v1")
+        old_figure = old.filename("chart", "city_id_0", False)
+        old.put(old_figure, self.chart("city_id_0", False))
+        size = os.path.getsize(old_figure)
+        # The older dataset version goes first even though it was used last
+        os.utime(old_figure, (2**31, 2**31))
+
+        store = FigureStore(self.path, "v2", max_bytes=3.5 * size)
+        filenames = [store.filename("chart", f"city_id_{i}", False) for i in range(3)]
+        for i, filename in enumerate(filenames):
+            store.put(filename, self.chart(f"city_id_{i}", False))
+            os.utime(filename, (i, i))
+        self.assertFalse(os.path.exists(old_figure))
+        self.assertTrue(all(os.path.exists(f) for f in filenames))
+
+        # Then the least recently used, down to 90% of the cap
+        store.get(filenames[0])
+        store.put(
+            store.filename("chart", "city_id_3", False),
+            self.chart("city_id_3", False),
+        )
+        self.assertEqual([os.path.exists(f) for f in filenames], [True, False, True])
+        self.assertLessEqual(store._size, 0.9 * store.max_bytes)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        store = FigureStore(temporary_dir(self, "figures_"), "v1", bypass=is_profiling)
+
+        @store.cache
+        def chart(city_country, is_fahrenheit):
+            self.calls.append(city_country)
+            return go.Figure()
+
+        server = flask.Flask(__name__)
+
+        @server.route("/_dash-update-component", methods=["POST"])
+        def update():
+            chart("city_id_1", False)
+            return "{}"
+
+        register_profiler(server, "s3cret", temporary_dir(self, "profiles_"))
+        self.client = server.test_client()
+
+    def test_enable(self):
+        self.assertEqual(
+            self.client.get("/_profile/enable?token=wrong").status_code, 403
+        )
+        # The cookie is secure only, so the browser is on https
+        base_url = "https://localhost"
+        response = self.client.get("/_profile/enable?token=s3cret", base_url=base_url)
+        self.assertEqual(response.status_code, 200)
+        cookie = response.headers["Set-Cookie"]
+        self.assertNotIn("s3cret", cookie)
+        for attribute in ("HttpOnly", "Secure", "SameSite=Strict"):
+            self.assertIn(attribute, cookie)
+
+        # The cookie alone now turns the profiler on
+        response = self.client.post("/_dash-update-component", base_url=base_url)
+        self.assertIn("X-Profile-File", response.headers)
+
+        # The token itself is not accepted as the cookie
+        self.client.set_cookie("profile_token", "s3cret", domain="localhost")
+        response = self.client.post("/_dash-update-component", base_url=base_url)
+        self.assertNotIn("X-Profile-File", response.headers)
+
+    def test_profiled_requests_skip_the_figure_store(self):
+        for _ in range(2):
+            response = self.client.post("/_dash-update-component")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.calls), 1)
+
+        headers = {"X-Profile": "s3cret"}
+        self.client.post("/_dash-update-component", headers=headers)
+        self.client.post("/_dash-update-component", headers=headers)
+        self.assertEqual(len(self.calls), 3)
+        self.assertFalse(is_profiling())
+
+    def test_non_ascii_token(self):
+        for url in ("/_profile/enable?token=%C3%A9", "/_profile/?token=%C3%A9"):
+            self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.post("/_dash-update-component?token=%C3%A9")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-File", response.headers)
+
+    def test_profile_and_download(self):
+        response = self.client.post("/_dash-update-component")
+        self.assertNotIn("X-Profile-File", response.headers)
+
+        headers = {"X-Profile": "s3cret"}
+        response = self.client.post("/_dash-update-component", headers=headers)
+        profile_file = response.headers["X-Profile-File"]
+        self.assertEqual(self.client.get(profile_file).status_code, 403)
+        download = self.client.get(profile_file, headers=headers)
+        self.assertEqual(download.status_code, 200)
+        self.assertGreater(len(download.data), 0)
+        self.assertEqual(
+            self.client.get("/_profile/", headers=headers).get_json(),
+            [profile_file.rsplit("/", 1)[1]],
+        )
 
 
 class TestSnapshot(snapshottest.TestCase):
     def test_snapshot_match(self):
-        df = preprocess(load_data)
-        self.assertMatchSnapshot(df.info(), "df_info")
-        self.assertMatchSnapshot(df.describe(datetime_is_numeric=True), "df_describe")
+        monthly = calc_monthly(city_by_index(LOS_ANGELES)).round(2)
+        self.assertMatchSnapshot(monthly.to_csv(), "los_angeles_monthly")
+        self.assertMatchSnapshot(
+            app.data_summary(build_reduced_city_lookup(), city_by_index(LOS_ANGELES)),
+            "data_summary",
+        )
 
 
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()